@@ -11,14 +11,38 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 import jwt
 import json
 from datetime import datetime, timedelta
 from functools import wraps
 import hashlib
+import hmac
 import shutil
+import csv
+import io
+import re
+import threading
+import time
+import bisect
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import urllib.request
+import urllib.error
+import zlib
+import gzip
+import random
+import cProfile
+import pstats
+import tracemalloc
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，分区写锁退化为不加锁
+    fcntl = None
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
@@ -62,57 +86,762 @@ def hash_password(password):
     """密码哈希"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+# ==================== 阶段计时 ====================
+
+# 请求期间按阶段累计耗时（JSON解析、序列化、加锁等待、备份、ID查找、jsonify），供慢请求日志和性能剖析使用。
+# 未开启计时的线程（后台任务、复制线程）中只多一次属性查找
+_phase_state = threading.local()
+
+@contextmanager
+def phase(name):
+    """累计当前请求某个阶段的耗时和次数"""
+    timings = getattr(_phase_state, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += time.perf_counter() - start
+        entry[1] += 1
+
+# ==================== 分区存储 ====================
+
+# 每个集合存为独立的分区文件，phones/accounts/bills 还可按所有者(createdBy)或ID哈希再分片。
+# 写入只重写所在分区，并以分区文件锁串行化同一分区的读改写；不同分区可由不同worker并行写入。
+# 分片方式通过 STORAGE_SHARDING 配置，例如 "phones=hash:8,bills=owner"，记录在 manifest.json 中
+PARTITION_DIR = os.path.join(DATA_DIR, 'partitions')
+MANIFEST_FILE = os.path.join(DATA_DIR, 'manifest.json')
+STORAGE_SHARDING = os.environ.get('STORAGE_SHARDING', '')
+LIST_COLLECTIONS = ['users', 'phones', 'accounts', 'bills']
+SHARDABLE_COLLECTIONS = ['phones', 'accounts', 'bills']
+OWNER_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+os.makedirs(PARTITION_DIR, exist_ok=True)
+
+_partition_cache = {}
+# 分区记录条数按文件签名记录（只存条数，不持有数据），备份计数不必为此解析或缓存整个分区
+_partition_counts = {}
+_collection_cache = {}
+_storage_state = {'sharding': None}
+
+def parse_sharding(text):
+    """解析分片配置，未配置的集合不分片"""
+    sharding = {c: {'mode': 'none'} for c in SHARDABLE_COLLECTIONS}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        collection, _, spec = item.partition('=')
+        mode, _, shards = spec.strip().partition(':')
+        collection = collection.strip()
+        if collection not in sharding or mode not in ('none', 'owner', 'hash'):
+            raise ValueError(f'无效的分片配置: {item}')
+        sharding[collection] = {'mode': mode}
+        if mode == 'hash':
+            sharding[collection]['shards'] = int(shards or 8)
+    return sharding
+
+def partition_path(name):
+    return os.path.join(PARTITION_DIR, name + '.json')
+
+def partition_collection(name):
+    """分区名对应的集合名，如 phones.h03 -> phones"""
+    return name.split('.', 1)[0]
+
+def partition_default(name):
+    collection = partition_collection(name)
+    if collection == 'settings':
+        return dict(DEFAULT_DATA['settings'])
+    if collection == 'users':
+        return [dict(u) for u in DEFAULT_DATA['users']]
+    return []
+
+def partition_of(collection, record):
+    """记录所在的分区名"""
+    if collection not in SHARDABLE_COLLECTIONS:
+        return collection
+    spec = _storage_state['sharding'][collection]
+    if spec['mode'] == 'hash':
+        shard = zlib.crc32(str(record.get('id')).encode('utf-8')) % spec['shards']
+        return f'{collection}.h{shard:02d}'
+    if spec['mode'] == 'owner':
+        owner = str(record.get('createdBy') or '_')
+        if not OWNER_KEY_PATTERN.match(owner):
+            owner = 'x' + hashlib.md5(owner.encode('utf-8')).hexdigest()[:16]
+        return f'{collection}.o.{owner}'
+    return collection
+
+def list_partitions(collection=None):
+    """列出现有分区名（按名称排序），可只列某个集合的分区"""
+    names = []
+    for filename in os.listdir(PARTITION_DIR):
+        if not filename.endswith('.json'):
+            continue
+        name = filename[:-5]
+        if collection is None or partition_collection(name) == collection:
+            names.append(name)
+    names.sort()
+    return names
+
+def file_signature(path):
+    """文件签名，原子替换后必然改变"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def partition_signature(name):
+    return file_signature(partition_path(name))
+
+def revision_of(names):
+    """一组分区的数据版本号"""
+    signatures = repr([(name, partition_signature(name)) for name in names])
+    return hashlib.md5(signatures.encode('utf-8')).hexdigest()[:16]
+
+def collection_signature(collection):
+    """单个集合的数据版本号"""
+    return revision_of(list_partitions(collection))
+
+def data_revision(collections):
+    """若干集合的数据版本号，只看这些集合的分区（账单另含归档索引）。
+    响应缓存和条件请求按路由实际读取的集合取版本，登录更新 users 等无关写入不会让它们失效"""
+    names = [name for name in list_partitions() if partition_collection(name) in collections]
+    signatures = [(name, partition_signature(name)) for name in names]
+    if 'bills' in collections:
+        signatures.append(('archive', file_signature(ARCHIVE_INDEX_FILE)))
+    return hashlib.md5(repr(signatures).encode('utf-8')).hexdigest()[:16]
+
+def read_partition_file(name):
+    """直接读取分区文件，返回调用方可修改的新对象"""
+    try:
+        with phase('parse'), open(partition_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return partition_default(name)
+
+def read_partition(name):
+    """读取只读分区数据，按文件签名缓存；调用方不得修改返回值"""
+    signature = partition_signature(name)
+    cached = _partition_cache.get(name)
+    if cached and signature is not None and cached[0] == signature:
+        return cached[1]
+    data = read_partition_file(name)
+    _partition_cache[name] = (signature, data)
+    _partition_counts[name] = (signature, len(data))
+    return data
+
+def partition_count(name, signature):
+    """签名对应的分区记录条数，未知时返回None"""
+    cached = _partition_cache.get(name)
+    if cached and cached[0] == signature:
+        return len(cached[1])
+    counted = _partition_counts.get(name)
+    if counted and counted[0] == signature:
+        return counted[1]
+    return None
+
+def write_partition(name, data):
+    """写临时文件后原子替换分区文件，并把写入的数据放入缓存（调用方之后不得再修改 data）"""
+    with phase('serialize'):
+        content = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    with phase('write'):
+        temp_file = f"{partition_path(name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_file, partition_path(name))
+    # 本进程随后的读取（备份计数、统计等）无需重新解析刚写入的文件
+    signature = partition_signature(name)
+    _partition_cache[name] = (signature, data)
+    _partition_counts[name] = (signature, len(data))
+
+def append_partition(name, new_records, keep_cache=True):
+    """在分区末尾追加记录（调用方持有分区锁）：复制现有文件后只序列化新增部分，不读取、不重新序列化整个分区。
+
+    keep_cache: 分区已在缓存且与文件一致时，把新增记录并入缓存（单条写入）；为False时丢弃该分区的缓存，
+    批量导入不会因此在内存中持有整个分区。记录条数照常累加，备份计数无需解析分区。
+    文件不存在、为空数组或结尾不是 ']' 时读取后整体重写
+    """
+    path = partition_path(name)
+    before = partition_signature(name)
+    with phase('write'):
+        appendable = False
+        if before is not None:
+            with open(path, 'rb') as f:
+                f.seek(max(os.path.getsize(path) - 2, 0))
+                tail = f.read()
+            appendable = tail.endswith(b']') and tail != b'[]'
+    if not appendable:
+        write_partition(name, list(read_partition_file(name)) + new_records)
+        return
+    with phase('serialize'):
+        content = json.dumps(new_records, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with phase('write'):
+        temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, temp_file)
+        with open(temp_file, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b',' + content[1:])
+        os.replace(temp_file, path)
+    after = partition_signature(name)
+    count = partition_count(name, before)
+    cached = _partition_cache.pop(name, None)
+    if keep_cache and cached and cached[0] == before:
+        _partition_cache[name] = (after, cached[1] + new_records)
+    if count is not None:
+        _partition_counts[name] = (after, count + len(new_records))
+
+@contextmanager
+def partition_lock(name):
+    """分区写锁（跨进程），Windows 本地开发环境下不加锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(PARTITION_DIR, name + '.lock'), 'a') as lock_file:
+        with phase('lock_wait'):
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@contextmanager
+def snapshot_lock(exclusive=False):
+    """整库读写锁（跨进程）：跨多个分区的写入在排他锁内替换文件，跨分区读取持共享锁，
+    因此读者不会看到只写了一半的整库/整集合替换。单分区写入本身是原子的，无需此锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(PARTITION_DIR, '_snapshot.lock'), 'a') as lock_file:
+        with phase('lock_wait'):
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_collection(collection):
+    """读取集合的只读数据（只加载该集合的分区）；调用方不得修改返回值"""
+    names = list_partitions(collection)
+    if len(names) == 1:
+        return read_partition(names[0])
+    with snapshot_lock():
+        names = list_partitions(collection)
+        revision = revision_of(names)
+        cached = _collection_cache.get(collection)
+        if cached and cached[0] == revision:
+            return cached[1]
+        records = []
+        for name in names:
+            records.extend(read_partition(name))
+    _collection_cache[collection] = (revision, records)
+    return records
+
+def split_partitions(data):
+    """把整库数据按当前分片方式拆成 {分区名: 数据}"""
+    parts = {'users': data.get('users', []), 'settings': data.get('settings', {})}
+    for collection in SHARDABLE_COLLECTIONS:
+        spec = _storage_state['sharding'][collection]
+        if spec['mode'] == 'hash':
+            for shard in range(spec['shards']):
+                parts[f'{collection}.h{shard:02d}'] = []
+        elif spec['mode'] == 'none':
+            parts[collection] = []
+        for record in data.get(collection, []):
+            parts.setdefault(partition_of(collection, record), []).append(record)
+    return parts
+
+def assemble_partitions(read, names):
+    """由分区数据拼回整库结构"""
+    data = {c: [] for c in LIST_COLLECTIONS}
+    data['settings'] = dict(DEFAULT_DATA['settings'])
+    for name in names:
+        collection = partition_collection(name)
+        if collection == 'settings':
+            data['settings'] = read(name)
+        elif collection in data:
+            data[collection].extend(read(name))
+    return data
+
 def load_database():
-    """加载数据库"""
+    """加载整库数据（新对象，可修改后交给 save_database）"""
     try:
-        if os.path.exists(DATABASE_FILE):
-            with open(DATABASE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            # 创建默认数据库
-            save_database(DEFAULT_DATA)
-            return DEFAULT_DATA.copy()
+        with snapshot_lock():
+            return assemble_partitions(read_partition_file, list_partitions())
     except Exception as e:
         print(f"加载数据库失败: {e}")
-        return DEFAULT_DATA.copy()
+        return json.loads(json.dumps(DEFAULT_DATA))
+
+def load_database_snapshot():
+    """加载只读整库快照，各分区按文件签名缓存；调用方不得修改返回的数据"""
+    with snapshot_lock():
+        data = {c: load_collection(c) for c in LIST_COLLECTIONS}
+        data['settings'] = read_partition('settings')
+    return data
 
 def save_database(data):
-    """保存数据库并创建备份"""
+    """保存整库数据：持有全部相关分区锁比较并只重写有变化的分区，一次性对读者可见，并创建备份"""
     try:
-        # 保存主数据库
-        with open(DATABASE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        # 创建备份
-        backup_filename = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        backup_path = os.path.join(BACKUP_DIR, backup_filename)
-        shutil.copy2(DATABASE_FILE, backup_path)
-        
-        # 清理旧备份（保留最近10个）
-        cleanup_old_backups()
-        
+        parts = split_partitions(data)
+        names = sorted(set(parts) | set(list_partitions()))
+
+        # 按名称顺序加锁，避免与其他写入者死锁；加锁后再比较，不会覆盖比较之前的并发写入
+        with ExitStack() as stack:
+            for name in names:
+                stack.enter_context(partition_lock(name))
+            changed = [name for name, value in parts.items() if read_partition(name) != value]
+            # 按所有者分片时，不再出现的所有者分区需要清空
+            stale = [name for name in names if name not in parts and read_partition(name)]
+            if not changed and not stale:
+                return True
+            with snapshot_lock(exclusive=True):
+                for name in changed:
+                    write_partition(name, parts[name])
+                for name in stale:
+                    write_partition(name, [])
+            collections = sorted({partition_collection(name) for name in changed + stale})
+            log_mutations([{'op': 'replace', 'collection': c, 'data': data.get(c)} for c in collections])
+
+        after_write()
         return True
     except Exception as e:
         print(f"保存数据库失败: {e}")
         return False
 
+def after_write():
+    """每次写入后创建备份"""
+    with phase('backup'):
+        # 创建备份
+        create_backup()
+
+        # 清理旧备份（保留最近10个）
+        cleanup_old_backups()
+
+def insert_record(collection, record):
+    """追加一条记录，只重写其所在分区"""
+    name = partition_of(collection, record)
+    with partition_lock(name):
+        before = partition_signature(name)
+        append_partition(name, [record])
+        add_to_created_index(collection, name, before, partition_signature(name), record)
+        log_mutations([{'op': 'insert', 'collection': collection, 'record': record}])
+    after_write()
+
+def insert_records(collection, records, backup=True):
+    """批量追加记录：按分区分组，每个分区加锁重写一次；backup=False 时由调用方在最后统一备份"""
+    groups = {}
+    for record in records:
+        groups.setdefault(partition_of(collection, record), []).append(record)
+    for name, group in sorted(groups.items()):
+        with partition_lock(name):
+            append_partition(name, group, keep_cache=False)
+            log_mutations([{'op': 'insert_many', 'collection': collection, 'records': group}])
+    if backup and records:
+        after_write()
+
+def modify_record(collection, record_id, change, owner_hint=None):
+    """修改或删除一条记录：change(旧记录) 返回新记录，返回None表示删除。
+
+    只锁定并重写记录所在分区；找不到记录时返回None，否则返回旧记录
+    """
+    names = list_partitions(collection)
+    spec = _storage_state['sharding'].get(collection, {'mode': 'none'})
+    if spec['mode'] == 'hash':
+        names = [partition_of(collection, {'id': record_id})]
+    elif spec['mode'] == 'owner' and owner_hint:
+        # 优先查找当前用户的分区
+        hinted = partition_of(collection, {'createdBy': owner_hint})
+        names.sort(key=lambda name: name != hinted)
+
+    for name in names:
+        records = read_partition(name)
+        with phase('id_scan'):
+            found = any(r.get('id') == record_id for r in records)
+        if not found:
+            continue
+        with partition_lock(name):
+            records = list(read_partition(name))
+            for i, old in enumerate(records):
+                if old.get('id') == record_id:
+                    new = change(old)
+                    if new is None:
+                        records.pop(i)
+                        mutation = {'op': 'delete', 'collection': collection, 'id': record_id}
+                    else:
+                        records[i] = new
+                        mutation = {'op': 'update', 'collection': collection, 'id': record_id, 'record': new}
+                    write_partition(name, records)
+                    log_mutations([mutation])
+                    break
+            else:
+                continue
+        after_write()
+        return old
+    return None
+
+def replace_collection(collection, records):
+    """整体替换一个集合的数据，只重写该集合的分区"""
+    parts = {name: value for name, value in split_partitions({collection: records}).items()
+             if partition_collection(name) == collection}
+    names = sorted(set(parts) | set(list_partitions(collection)))
+
+    # 持有集合全部分区锁后再比较，替换在整库排他锁内完成，读者看不到替换了一半的集合
+    with ExitStack() as stack:
+        for name in names:
+            stack.enter_context(partition_lock(name))
+        changed = [name for name in names if read_partition(name) != parts.get(name, [])]
+        if not changed:
+            return
+        with snapshot_lock(exclusive=True):
+            for name in changed:
+                write_partition(name, parts.get(name, []))
+        log_mutations([{'op': 'replace', 'collection': collection, 'data': records}])
+    after_write()
+
+def collection_ids(collection):
+    """集合中全部记录的ID：已缓存的分区直接取，其余分区逐个解析后即释放、不放入缓存（批量导入查重用）"""
+    ids = set()
+    for name in list_partitions(collection):
+        signature = partition_signature(name)
+        cached = _partition_cache.get(name)
+        records = cached[1] if cached and cached[0] == signature else read_partition_file(name)
+        _partition_counts[name] = (signature, len(records))
+        ids.update(record.get('id') for record in records)
+    return ids
+
+def clear_collection_records(collection):
+    """清空一个集合，返回删除条数（账单包括归档中的账单）"""
+    if collection == 'bills':
+        return clear_bills()
+    count = len(load_collection(collection))
+    replace_collection(collection, [])
+    return count
+
+def init_storage():
+    """初始化分区存储：首次启动时从旧版 database.json 迁移，分片配置变化时重新分区"""
+    sharding = parse_sharding(STORAGE_SHARDING)
+    try:
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = None
+
+    if manifest and manifest.get('sharding') == sharding:
+        _storage_state['sharding'] = sharding
+        return
+
+    with partition_lock('_manifest'):
+        # 拿到锁后重新检查，其他worker可能已完成迁移
+        try:
+            with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest and manifest.get('sharding') == sharding:
+            _storage_state['sharding'] = sharding
+            return
+
+        if manifest is None and os.path.exists(DATABASE_FILE):
+            with open(DATABASE_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        elif manifest is None:
+            data = json.loads(json.dumps(DEFAULT_DATA))
+        else:
+            data = load_database()
+
+        old_names = list_partitions()
+        _storage_state['sharding'] = sharding
+        parts = split_partitions(data)
+        with snapshot_lock(exclusive=True):
+            for name, value in parts.items():
+                write_partition(name, value)
+            for name in old_names:
+                if name not in parts:
+                    os.remove(partition_path(name))
+
+        write_json_atomic(MANIFEST_FILE, {
+            'version': 1,
+            'sharding': sharding,
+            'updatedAt': datetime.now().isoformat()
+        })
+        if os.path.exists(DATABASE_FILE):
+            os.replace(DATABASE_FILE, DATABASE_FILE + '.migrated')
+
+def write_json_atomic(path, data):
+    """写临时文件后原子替换"""
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_file, path)
+
+# ==================== 备份 ====================
+
+# 备份是一个目录，以硬链接保存写入时刻的全部分区文件：分区文件总是整体原子替换，
+# 旧文件内容由链接保留，因此备份无需复制数据。每个备份旁边写一个元数据文件
+# （大小、时间、各集合条数），列出恢复点时无需读取备份本身
+BACKUP_META_SUFFIX = '.meta'
+BACKUP_NAME_PATTERN = re.compile(r'^backup_[0-9_]+(\.json)?$')
+BACKUP_COLLECTIONS = ['users', 'phones', 'accounts', 'bills']
+
+def create_backup():
+    """为当前全部分区创建备份，并写入元数据"""
+    now = datetime.now()
+    backup_name = f"backup_{now.strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}"
+    backup_path = os.path.join(BACKUP_DIR, backup_name)
+    os.makedirs(backup_path)
+
+    size = 0
+    counts = {c: 0 for c in BACKUP_COLLECTIONS}
+    # 持整库读锁建立链接，备份不会落在一次整库/整集合替换的中间
+    with snapshot_lock():
+        for name in list_partitions():
+            target = os.path.join(backup_path, name + '.json')
+            try:
+                os.link(partition_path(name), target)
+            except OSError:
+                # 文件系统不支持硬链接时退化为复制
+                shutil.copy2(partition_path(name), target)
+    previous = latest_backup_partitions()
+    partitions = {}
+    for filename in os.listdir(backup_path):
+        name, target = filename[:-5], os.path.join(backup_path, filename)
+        size += os.path.getsize(target)
+        if partition_collection(name) in counts:
+            signature = list(file_signature(target))
+            count = backup_partition_count(name, target, previous.get(name))
+            partitions[name] = {'signature': signature, 'count': count}
+            counts[partition_collection(name)] += count
+
+    meta = {
+        'name': backup_name,
+        'createdAt': now.isoformat(),
+        'size': size,
+        'counts': counts,
+        # 各分区文件签名与条数：下一次备份链接到同一个文件（其他worker写入后未再变化）时沿用条数
+        'partitions': partitions
+    }
+    with open(backup_path + BACKUP_META_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+def latest_backup_partitions():
+    """最近一个备份元数据中的分区签名与条数，没有时返回空字典"""
+    names = sorted((f for f in os.listdir(BACKUP_DIR) if BACKUP_NAME_PATTERN.match(f)), reverse=True)
+    for filename in names:
+        try:
+            with open(os.path.join(BACKUP_DIR, filename + BACKUP_META_SUFFIX), 'r', encoding='utf-8') as f:
+                return json.load(f).get('partitions') or {}
+        except (OSError, ValueError):
+            continue
+    return {}
+
+def backup_partition_count(name, target, previous=None):
+    """备份中分区的记录条数，依次尝试：本进程已知的条数（写入者刚写过）、
+    上一个备份中同一文件（签名相同）的条数，都没有时解析备份文件并记下条数"""
+    signature = file_signature(target)
+    count = partition_count(name, signature)
+    if count is not None:
+        return count
+    if previous and tuple(previous['signature']) == signature:
+        return previous['count']
+    with phase('parse'), open(target, 'r', encoding='utf-8') as f:
+        count = len(json.load(f))
+    _partition_counts[name] = (signature, count)
+    return count
+
+def remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 def cleanup_old_backups():
-    """清理旧备份文件"""
+    """清理旧备份（目录及旧版单文件备份）"""
     try:
         backup_files = []
         for filename in os.listdir(BACKUP_DIR):
-            if filename.startswith('backup_') and filename.endswith('.json'):
+            if BACKUP_NAME_PATTERN.match(filename):
                 filepath = os.path.join(BACKUP_DIR, filename)
-                backup_files.append((filepath, os.path.getmtime(filepath)))
+                try:
+                    backup_files.append((filepath, os.path.getmtime(filepath)))
+                except FileNotFoundError:
+                    # 其他worker刚刚清理掉
+                    continue
         
-        # 按修改时间排序，保留最新的10个
+        # 按修改时间排序，保留最新的10个；多个worker可能同时清理，文件已不存在时忽略
         backup_files.sort(key=lambda x: x[1], reverse=True)
         for filepath, _ in backup_files[10:]:
-            os.remove(filepath)
+            if os.path.isdir(filepath):
+                shutil.rmtree(filepath, ignore_errors=True)
+            else:
+                remove_if_exists(filepath)
+            remove_if_exists(filepath + BACKUP_META_SUFFIX)
             
     except Exception as e:
         print(f"清理备份文件失败: {e}")
 
+def list_restore_points():
+    """列出所有恢复点（新的在前），只读取元数据"""
+    points = []
+    for filename in os.listdir(BACKUP_DIR):
+        if not BACKUP_NAME_PATTERN.match(filename):
+            continue
+        filepath = os.path.join(BACKUP_DIR, filename)
+        try:
+            with open(filepath + BACKUP_META_SUFFIX, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            meta.pop('partitions', None)
+        except (OSError, ValueError):
+            # 旧版本备份没有元数据，只提供文件信息
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            meta = {
+                'name': filename,
+                'createdAt': datetime.fromtimestamp(st.st_mtime).isoformat(),
+                'size': st.st_size,
+                'counts': None
+            }
+        points.append(meta)
+    points.sort(key=lambda m: m['createdAt'], reverse=True)
+    return points
+
+def read_backup(name):
+    """读取指定备份的整库数据，名称不合法或不存在时返回None"""
+    if not BACKUP_NAME_PATTERN.match(name):
+        return None
+    filepath = os.path.join(BACKUP_DIR, name)
+    if os.path.isdir(filepath):
+        names = sorted(f[:-5] for f in os.listdir(filepath) if f.endswith('.json'))
+
+        def read(partition):
+            with open(os.path.join(filepath, partition + '.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        return assemble_partitions(read, names)
+    if not os.path.exists(filepath):
+        return None
+    # 旧版单文件备份
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+init_storage()
+
+# ==================== ID 分配与创建时间索引 ====================
+
+# ID格式: <前缀>_<毫秒时间戳11位十六进制><节点6位十六进制><序号3位十六进制>
+# 时间戳在前，字典序即创建顺序；节点默认取进程号，保证同机多个gunicorn worker互不冲突。
+# 多机部署时通过 ID_NODE_ID 指定机器号(0~4095)：节点高12位为机器号，低12位为本机进程占用的槽位号
+# （槽位锁文件跨进程互斥，进程退出时自动释放），同一台机器上的多个worker仍互不冲突
+ID_NODE_ID = os.environ.get('ID_NODE_ID')
+ID_SEQUENCE_BITS = 12
+ID_SLOT_BITS = 12
+ID_SLOT_DIR = os.path.join(DATA_DIR, 'id_slots')
+
+os.makedirs(ID_SLOT_DIR, exist_ok=True)
+
+_id_lock = threading.Lock()
+_id_state = {'pid': None, 'node': 0, 'last_ms': 0, 'seq': 0, 'slot_file': None}
+
+def claim_id_slot():
+    """为当前进程占用一个本机唯一的槽位号，返回 (槽位号, 锁文件)；锁文件须在进程存活期间保持打开"""
+    if fcntl is None:
+        return os.getpid() & ((1 << ID_SLOT_BITS) - 1), None
+    for slot in range(1 << ID_SLOT_BITS):
+        lock_file = open(os.path.join(ID_SLOT_DIR, f'slot_{slot}.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # 其他进程（或fork前的父进程）占用中
+            lock_file.close()
+            continue
+        return slot, lock_file
+    raise RuntimeError('ID分配器槽位已用尽')
+
+def generate_id(prefix):
+    """生成单调递增、可排序且跨进程不冲突的记录ID"""
+    with _id_lock:
+        pid = os.getpid()
+        if _id_state['pid'] != pid:
+            # fork之后（如gunicorn --preload）重新确定节点号并清零序号
+            if ID_NODE_ID:
+                slot, slot_file = claim_id_slot()
+                node = (int(ID_NODE_ID) & ((1 << (24 - ID_SLOT_BITS)) - 1)) << ID_SLOT_BITS | slot
+            else:
+                node, slot_file = pid, None
+            _id_state.update(pid=pid, node=node & 0xFFFFFF, last_ms=0, seq=0, slot_file=slot_file)
+
+        now_ms = max(int(time.time() * 1000), _id_state['last_ms'])
+        if now_ms == _id_state['last_ms']:
+            seq = _id_state['seq'] + 1
+            if seq >= 1 << ID_SEQUENCE_BITS:
+                # 同一毫秒内序号用尽，借用下一毫秒
+                now_ms += 1
+                seq = 0
+        else:
+            seq = 0
+        _id_state.update(last_ms=now_ms, seq=seq)
+        return f"{prefix}_{now_ms:011x}{_id_state['node']:06x}{seq:03x}"
+
+_created_index_cache = {}
+
+def created_index_signatures(collection):
+    """创建时间索引依据的各分区版本（账单另含归档索引）"""
+    signatures = {name: partition_signature(name) for name in list_partitions(collection)}
+    if collection == 'bills':
+        signatures['_archive'] = file_signature(ARCHIVE_INDEX_FILE)
+    return signatures
+
+def get_created_index(collection):
+    """获取集合的创建时间索引 (keys, records)，两者按 createdAt 升序对齐；账单包括归档。
+
+    其他worker写入或本进程修改/删除记录后整体重建：分区内记录基本按创建顺序追加，排序接近 O(n)。
+    本进程新增记录时由 add_to_created_index 就地插入，不重建
+    """
+    signatures = created_index_signatures(collection)
+    cached = _created_index_cache.get(collection)
+    if cached and cached['signatures'] == signatures:
+        return cached['keys'], cached['records']
+
+    records = collection_records(collection)
+    ordered = sorted(records, key=lambda r: r.get('createdAt') or '')
+    keys = [r.get('createdAt') or '' for r in ordered]
+    _created_index_cache[collection] = {'signatures': signatures, 'keys': keys, 'records': ordered}
+    return keys, ordered
+
+def add_to_created_index(collection, name, before, after, record):
+    """本进程向分区 name 追加记录后插入创建时间索引：二分查找位置，复制列表后整体替换，
+    正在读取旧索引的请求不受影响。缓存的分区版本与写入前(before)一致时才插入，否则留待下次重建"""
+    cached = _created_index_cache.get(collection)
+    if not cached or cached['signatures'].get(name) != before:
+        return
+    if collection == 'bills' and record.get('id') in archived_bill_ids():
+        # 重新添加已归档的账单：索引中已有归档副本，交给重建去重
+        return
+    key = record.get('createdAt') or ''
+    i = bisect.bisect_right(cached['keys'], key)
+    _created_index_cache[collection] = {
+        'signatures': {**cached['signatures'], name: after},
+        'keys': cached['keys'][:i] + [key] + cached['keys'][i:],
+        'records': cached['records'][:i] + [record] + cached['records'][i:]
+    }
+
+def query_created_range(collection, start=None, end=None, limit=None, newest_first=True, offset=0):
+    """按创建时间区间 [start, end) 查询记录，跳过前 offset 条；索引有效时为 O(log n + k)"""
+    keys, records = get_created_index(collection)
+    lo = bisect.bisect_left(keys, start) if start else 0
+    hi = bisect.bisect_left(keys, end) if end else len(keys)
+    total = max(hi - lo, 0)
+    if newest_first:
+        hi = max(hi - offset, lo)
+        stop = max(hi - limit, lo) if limit is not None else lo
+        items = records[stop:hi][::-1]
+    else:
+        lo = min(lo + offset, hi)
+        items = records[lo:min(lo + limit, hi) if limit is not None else hi]
+    return items, total
+
 def token_required(f):
     """Token验证装饰器"""
     @wraps(f)
@@ -129,9 +858,8 @@ def token_required(f):
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
             current_user_id = data['user_id']
             
-            # 验证用户是否存在
-            db = load_database()
-            user = next((u for u in db['users'] if u['id'] == current_user_id), None)
+            # 验证用户是否存在（只读取用户分区，未变化时复用缓存）
+            user = next((u for u in read_partition('users') if u['id'] == current_user_id), None)
             if not user:
                 return jsonify({'message': '用户不存在'}), 401
                 
@@ -144,6 +872,103 @@ def token_required(f):
     
     return decorated
 
+def admin_required(f):
+    """管理员权限装饰器，需放在 token_required 之后"""
+    @wraps(f)
+    def decorated(current_user_id, *args, **kwargs):
+        current_user = next((u for u in read_partition('users') if u['id'] == current_user_id), None)
+        if not current_user or current_user.get('role') != 'admin':
+            return jsonify({'message': '权限不足'}), 403
+        return f(current_user_id, *args, **kwargs)
+
+    return decorated
+
+def request_user_id():
+    """解析请求中的令牌，返回用户ID；没有令牌或令牌无效时返回None"""
+    auth = request.headers.get('Authorization', '')
+    try:
+        payload = jwt.decode(auth[7:] if auth.startswith('Bearer ') else auth,
+                             app.config['SECRET_KEY'], algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    return payload.get('user_id')
+
+# ==================== 请求合并 ====================
+
+# 同一worker内，相同 (路由, 查询参数, 数据版本) 的并发读请求只计算一次并共享响应体，
+# 数据版本只取路由读取的集合，结果按版本缓存，这些集合变化后旧版本条目被淘汰
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 32))
+SINGLE_FLIGHT_TIMEOUT = 30
+
+_flight_lock = threading.Lock()
+_inflight_requests = {}
+_response_cache = OrderedDict()
+
+def _cached_response(entry, source):
+    body, status, mimetype = entry
+    response = Response(body, status=status, mimetype=mimetype)
+    response.headers['X-Cache'] = source
+    return response
+
+def _store_response(key, entry):
+    with _flight_lock:
+        # 同一路由的数据版本相同，只淘汰该路由旧版本的条目
+        path, revision = key[0], key[-1]
+        for stale in [k for k in _response_cache if k[0] == path and k[-1] != revision]:
+            del _response_cache[stale]
+        _response_cache[key] = entry
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+def single_flight(*collections):
+    """读请求合并装饰器，需放在 token_required 之后，仅用于响应与当前用户无关的只读路由。
+
+    collections 为路由读取的集合，缓存按这些集合的数据版本失效；不传时取路由参数 collection
+    """
+    def decorator(f):
+        return _single_flight(f, collections)
+    return decorator
+
+def _single_flight(f, collections):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        revision = data_revision(collections or [kwargs.get('collection')])
+        key = (request.path, request.query_string, revision)
+
+        with _flight_lock:
+            entry = _response_cache.get(key)
+            if entry is not None:
+                _response_cache.move_to_end(key)
+                return _cached_response(entry, 'HIT')
+            flight = _inflight_requests.get(key)
+            leader = flight is None
+            if leader:
+                flight = {'event': threading.Event(), 'entry': None}
+                _inflight_requests[key] = flight
+
+        if not leader:
+            flight['event'].wait(SINGLE_FLIGHT_TIMEOUT)
+            if flight['entry'] is not None:
+                return _cached_response(flight['entry'], 'SHARED')
+            # 首个请求失败或超时，自行计算
+            return f(*args, **kwargs)
+
+        try:
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                entry = (response.get_data(), response.status_code, response.mimetype)
+                flight['entry'] = entry
+                _store_response(key, entry)
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        finally:
+            with _flight_lock:
+                _inflight_requests.pop(key, None)
+            flight['event'].set()
+
+    return decorated
+
 # ==================== 认证相关 API ====================
 
 @app.route('/api/auth/login', methods=['POST'])
@@ -161,8 +986,7 @@ def login():
             }), 400
         
         # 加载用户数据
-        db = load_database()
-        user = next((u for u in db['users'] if u['username'] == username), None)
+        user = next((u for u in read_partition('users') if u['username'] == username), None)
         
         if not user or user['password'] != hash_password(password):
             return jsonify({
@@ -171,8 +995,8 @@ def login():
             }), 401
         
         # 更新最后登录时间
-        user['lastLogin'] = datetime.now().isoformat()
-        save_database(db)
+        last_login = datetime.now().isoformat()
+        modify_record('users', user['id'], lambda u: {**u, 'lastLogin': last_login})
         
         # 生成JWT令牌
         token = jwt.encode({
@@ -205,6 +1029,7 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'message': '服务器运行正常',
+        'role': REPLICATION_ROLE,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -212,11 +1037,11 @@ def health_check():
 
 @app.route('/api/phones', methods=['GET'])
 @token_required
+@single_flight('phones')
 def get_phones(current_user_id):
     """获取所有手机号码"""
     try:
-        db = load_database()
-        return jsonify(db['phones'])
+        return jsonify(load_collection('phones'))
     except Exception as e:
         return jsonify({'message': f'获取数据失败: {str(e)}'}), 500
 
@@ -226,22 +1051,18 @@ def add_phone(current_user_id):
     """添加手机号码"""
     try:
         data = request.get_json()
-        db = load_database()
         
         # 生成ID
         if 'id' not in data:
-            data['id'] = f"phone_{len(db['phones']) + 1}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            data['id'] = generate_id('phone')
         
         # 添加创建信息
         data['createdAt'] = datetime.now().isoformat()
         data['createdBy'] = current_user_id
         
-        db['phones'].append(data)
-        
-        if save_database(db):
-            return jsonify({'id': data['id'], 'message': '添加成功'}), 201
-        else:
-            return jsonify({'message': '保存失败'}), 500
+        # 只写入记录所在分区
+        insert_record('phones', data)
+        return jsonify({'id': data['id'], 'message': '添加成功'}), 201
             
     except Exception as e:
         return jsonify({'message': f'添加失败: {str(e)}'}), 500
@@ -252,22 +1073,21 @@ def update_phone(current_user_id, phone_id):
     """更新手机号码"""
     try:
         data = request.get_json()
-        db = load_database()
-        
-        # 查找并更新
-        for i, phone in enumerate(db['phones']):
-            if phone['id'] == phone_id:
-                data['id'] = phone_id
-                data['updatedAt'] = datetime.now().isoformat()
-                data['updatedBy'] = current_user_id
-                db['phones'][i] = data
-                
-                if save_database(db):
-                    return jsonify({'message': '更新成功'})
-                else:
-                    return jsonify({'message': '保存失败'}), 500
         
-        return jsonify({'message': '数据不存在'}), 404
+        def apply_update(phone):
+            data['id'] = phone_id
+            # 保留创建信息，保证创建时间索引稳定
+            for key in ('createdAt', 'createdBy'):
+                if key in phone:
+                    data[key] = phone[key]
+            data['updatedAt'] = datetime.now().isoformat()
+            data['updatedBy'] = current_user_id
+            return data
+        
+        # 查找并更新（只锁定并重写记录所在分区）
+        if modify_record('phones', phone_id, apply_update, owner_hint=current_user_id) is None:
+            return jsonify({'message': '数据不存在'}), 404
+        return jsonify({'message': '更新成功'})
         
     except Exception as e:
         return jsonify({'message': f'更新失败: {str(e)}'}), 500
@@ -277,30 +1097,21 @@ def update_phone(current_user_id, phone_id):
 def delete_phone(current_user_id, phone_id):
     """删除手机号码"""
     try:
-        db = load_database()
-        
-        # 查找并删除
-        for i, phone in enumerate(db['phones']):
-            if phone['id'] == phone_id:
-                db['phones'].pop(i)
-                
-                if save_database(db):
-                    return '', 204
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-        
-        return jsonify({'message': '数据不存在'}), 404
+        # 查找并删除（只锁定并重写记录所在分区）
+        if modify_record('phones', phone_id, lambda phone: None, owner_hint=current_user_id) is None:
+            return jsonify({'message': '数据不存在'}), 404
+        return '', 204
         
     except Exception as e:
         return jsonify({'message': f'删除失败: {str(e)}'}), 500
 
 @app.route('/api/accounts', methods=['GET'])
 @token_required
+@single_flight('accounts')
 def get_accounts(current_user_id):
     """获取所有账号"""
     try:
-        db = load_database()
-        return jsonify(db['accounts'])
+        return jsonify(load_collection('accounts'))
     except Exception as e:
         return jsonify({'message': f'获取数据失败: {str(e)}'}), 500
 
@@ -310,20 +1121,16 @@ def add_account(current_user_id):
     """添加账号"""
     try:
         data = request.get_json()
-        db = load_database()
         
         if 'id' not in data:
-            data['id'] = f"account_{len(db['accounts']) + 1}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            data['id'] = generate_id('account')
         
         data['createdAt'] = datetime.now().isoformat()
         data['createdBy'] = current_user_id
         
-        db['accounts'].append(data)
-        
-        if save_database(db):
-            return jsonify({'id': data['id'], 'message': '添加成功'}), 201
-        else:
-            return jsonify({'message': '保存失败'}), 500
+        # 只写入记录所在分区
+        insert_record('accounts', data)
+        return jsonify({'id': data['id'], 'message': '添加成功'}), 201
             
     except Exception as e:
         return jsonify({'message': f'添加失败: {str(e)}'}), 500
@@ -334,21 +1141,21 @@ def update_account(current_user_id, account_id):
     """更新账号"""
     try:
         data = request.get_json()
-        db = load_database()
-        
-        for i, account in enumerate(db['accounts']):
-            if account['id'] == account_id:
-                data['id'] = account_id
-                data['updatedAt'] = datetime.now().isoformat()
-                data['updatedBy'] = current_user_id
-                db['accounts'][i] = data
-                
-                if save_database(db):
-                    return jsonify({'message': '更新成功'})
-                else:
-                    return jsonify({'message': '保存失败'}), 500
         
-        return jsonify({'message': '数据不存在'}), 404
+        def apply_update(account):
+            data['id'] = account_id
+            # 保留创建信息，保证创建时间索引稳定
+            for key in ('createdAt', 'createdBy'):
+                if key in account:
+                    data[key] = account[key]
+            data['updatedAt'] = datetime.now().isoformat()
+            data['updatedBy'] = current_user_id
+            return data
+        
+        # 查找并更新（只锁定并重写记录所在分区）
+        if modify_record('accounts', account_id, apply_update, owner_hint=current_user_id) is None:
+            return jsonify({'message': '数据不存在'}), 404
+        return jsonify({'message': '更新成功'})
         
     except Exception as e:
         return jsonify({'message': f'更新失败: {str(e)}'}), 500
@@ -358,29 +1165,26 @@ def update_account(current_user_id, account_id):
 def delete_account(current_user_id, account_id):
     """删除账号"""
     try:
-        db = load_database()
-        
-        for i, account in enumerate(db['accounts']):
-            if account['id'] == account_id:
-                db['accounts'].pop(i)
-                
-                if save_database(db):
-                    return '', 204
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-        
-        return jsonify({'message': '数据不存在'}), 404
+        # 查找并删除（只锁定并重写记录所在分区）
+        if modify_record('accounts', account_id, lambda account: None, owner_hint=current_user_id) is None:
+            return jsonify({'message': '数据不存在'}), 404
+        return '', 204
         
     except Exception as e:
         return jsonify({'message': f'删除失败: {str(e)}'}), 500
 
 @app.route('/api/bills', methods=['GET'])
 @token_required
+@single_flight('bills')
 def get_bills(current_user_id):
-    """获取所有账单"""
+    """获取账单（含归档）：?from=YYYY-MM&to=YYYY-MM 只读区间覆盖到的归档月，?includeArchive=0 只返回热存储"""
+    try:
+        month_from, month_to = parse_month_range(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     try:
-        db = load_database()
-        return jsonify(db['bills'])
+        maybe_archive_bills()
+        return jsonify(query_bills(month_from, month_to, request.args.get('includeArchive') not in ('0', 'false')))
     except Exception as e:
         return jsonify({'message': f'获取数据失败: {str(e)}'}), 500
 
@@ -390,20 +1194,17 @@ def add_bill(current_user_id):
     """添加账单"""
     try:
         data = request.get_json()
-        db = load_database()
         
         if 'id' not in data:
-            data['id'] = f"bill_{len(db['bills']) + 1}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            data['id'] = generate_id('bill')
         
         data['createdAt'] = datetime.now().isoformat()
         data['createdBy'] = current_user_id
         
-        db['bills'].append(data)
-        
-        if save_database(db):
-            return jsonify({'id': data['id'], 'message': '添加成功'}), 201
-        else:
-            return jsonify({'message': '保存失败'}), 500
+        # 只写入记录所在分区
+        insert_record('bills', data)
+        maybe_archive_bills()
+        return jsonify({'id': data['id'], 'message': '添加成功'}), 201
             
     except Exception as e:
         return jsonify({'message': f'添加失败: {str(e)}'}), 500
@@ -414,21 +1215,21 @@ def update_bill(current_user_id, bill_id):
     """更新账单"""
     try:
         data = request.get_json()
-        db = load_database()
-        
-        for i, bill in enumerate(db['bills']):
-            if bill['id'] == bill_id:
-                data['id'] = bill_id
-                data['updatedAt'] = datetime.now().isoformat()
-                data['updatedBy'] = current_user_id
-                db['bills'][i] = data
-                
-                if save_database(db):
-                    return jsonify({'message': '更新成功'})
-                else:
-                    return jsonify({'message': '保存失败'}), 500
         
-        return jsonify({'message': '数据不存在'}), 404
+        def apply_update(bill):
+            data['id'] = bill_id
+            # 保留创建信息，保证创建时间索引稳定
+            for key in ('createdAt', 'createdBy'):
+                if key in bill:
+                    data[key] = bill[key]
+            data['updatedAt'] = datetime.now().isoformat()
+            data['updatedBy'] = current_user_id
+            return data
+        
+        # 查找并更新（只锁定并重写记录所在分区，已归档的账单写回热存储）
+        if modify_bill(bill_id, apply_update, owner_hint=current_user_id) is None:
+            return jsonify({'message': '数据不存在'}), 404
+        return jsonify({'message': '更新成功'})
         
     except Exception as e:
         return jsonify({'message': f'更新失败: {str(e)}'}), 500
@@ -438,29 +1239,21 @@ def update_bill(current_user_id, bill_id):
 def delete_bill(current_user_id, bill_id):
     """删除账单"""
     try:
-        db = load_database()
-        
-        for i, bill in enumerate(db['bills']):
-            if bill['id'] == bill_id:
-                db['bills'].pop(i)
-                
-                if save_database(db):
-                    return '', 204
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-        
-        return jsonify({'message': '数据不存在'}), 404
+        # 查找并删除（只锁定并重写记录所在分区，已归档的账单从归档段删除）
+        if modify_bill(bill_id, lambda bill: None, owner_hint=current_user_id) is None:
+            return jsonify({'message': '数据不存在'}), 404
+        return '', 204
         
     except Exception as e:
         return jsonify({'message': f'删除失败: {str(e)}'}), 500
 
 @app.route('/api/settings', methods=['GET'])
 @token_required
+@single_flight('settings')
 def get_settings(current_user_id):
     """获取设置"""
     try:
-        db = load_database()
-        return jsonify(db['settings'])
+        return jsonify(read_partition('settings'))
     except Exception as e:
         return jsonify({'message': f'获取设置失败: {str(e)}'}), 500
 
@@ -469,15 +1262,15 @@ def get_settings(current_user_id):
 def get_users(current_user_id):
     """获取用户列表（仅管理员）"""
     try:
-        db = load_database()
+        db_users = read_partition('users')
         # 检查当前用户是否为管理员
-        current_user = next((u for u in db['users'] if u['id'] == current_user_id), None)
+        current_user = next((u for u in db_users if u['id'] == current_user_id), None)
         if not current_user or current_user.get('role') != 'admin':
             return jsonify({'message': '权限不足'}), 403
         
         # 返回用户列表（不包含密码）
         users = []
-        for user in db['users']:
+        for user in db_users:
             safe_user = {k: v for k, v in user.items() if k != 'password'}
             users.append(safe_user)
         
@@ -486,14 +1279,16 @@ def get_users(current_user_id):
         return jsonify({'message': f'获取用户列表失败: {str(e)}'}), 500
 
 @app.route('/api/<collection>/clear', methods=['DELETE'])
+# 静态路径优先于 /api/phones/<phone_id> 等规则，否则 DELETE 会被误路由为删除单条记录
+@app.route('/api/phones/clear', methods=['DELETE'], defaults={'collection': 'phones'})
+@app.route('/api/accounts/clear', methods=['DELETE'], defaults={'collection': 'accounts'})
+@app.route('/api/bills/clear', methods=['DELETE'], defaults={'collection': 'bills'})
 @token_required
 def clear_collection(current_user_id, collection):
     """清空指定集合的所有数据（仅管理员）"""
     try:
-        db = load_database()
         # 检查当前用户是否为管理员
-        current_user = next((u for u in db['users'] if u['id'] == current_user_id), None)
-        if not current_user or current_user.get('role') != 'admin':
+        if not is_admin(current_user_id):
             return jsonify({'message': '权限不足，只有管理员可以清空数据'}), 403
         
         # 支持的集合类型
@@ -501,21 +1296,1867 @@ def clear_collection(current_user_id, collection):
         if collection not in valid_collections:
             return jsonify({'message': f'不支持的集合类型: {collection}'}), 400
         
-        # 清空指定集合
-        count = len(db[collection])
-        db[collection] = []
+        # 大集合可转为后台任务，立即返回202
+        if request.args.get('async') in ('1', 'true'):
+            job = submit_job('clear', {'collection': collection}, current_user_id)
+            return job_accepted(job)
         
-        if save_database(db):
-            return jsonify({
-                'message': f'成功清空 {collection}',
-                'deletedCount': count
-            })
-        else:
-            return jsonify({'message': '保存失败'}), 500
+        # 清空指定集合（只重写该集合的分区，账单连同归档一起清空）
+        count = clear_collection_records(collection)
+        
+        return jsonify({
+            'message': f'成功清空 {collection}',
+            'deletedCount': count
+        })
             
     except Exception as e:
         return jsonify({'message': f'清空失败: {str(e)}'}), 500
 
+@app.route('/api/<collection>/created', methods=['GET'])
+@token_required
+@single_flight()
+def get_created_range(current_user_id, collection):
+    """按创建时间区间查询（start含、end不含，ISO时间），默认最新在前"""
+    try:
+        if collection not in ('phones', 'accounts', 'bills'):
+            return jsonify({'message': f'不支持的集合类型: {collection}'}), 400
+
+        try:
+            limit = int(request.args.get('limit', 50))
+            offset = max(int(request.args.get('offset', 0)), 0)
+        except ValueError:
+            return jsonify({'message': 'limit/offset 必须是整数'}), 400
+        limit = max(1, min(limit, 1000))
+        newest_first = request.args.get('order', 'desc') != 'asc'
+
+        items, total = query_created_range(
+            collection,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            limit=limit,
+            newest_first=newest_first,
+            offset=offset
+        )
+        return jsonify({'items': items, 'total': total})
+    except Exception as e:
+        return jsonify({'message': f'查询失败: {str(e)}'}), 500
+
+# ==================== 导入导出 API ====================
+
+# 每批处理的行数：批内统一校验并追加，避免逐行操作整个集合
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 5000))
+# 导入每累计这么多行提交一次：每次提交都要重写目标分区，太小会使大文件导入的序列化开销成倍增加
+IMPORT_COMMIT_SIZE = int(os.environ.get('IMPORT_COMMIT_SIZE', 50000))
+# 响应中最多返回的错误明细条数，其余只计数
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 200))
+
+# 各集合的导入导出字段定义
+COLLECTION_SCHEMAS = {
+    'phones': {
+        'columns': ['id', 'number', 'carrier', 'status', 'packageType', 'plan', 'monthlyFee',
+                    'totalFee', 'owner', 'purpose', 'notes', 'createdAt', 'createdBy'],
+        'required': ['number'],
+        'numeric': ['monthlyFee', 'totalFee'],
+        'integer': [],
+        'list': ['purpose'],
+    },
+    'accounts': {
+        'columns': ['id', 'phoneId', 'platform', 'accountName', 'accountId', 'purpose', 'status',
+                    'followers', 'notes', 'createdAt', 'createdBy'],
+        'required': ['phoneId', 'accountName'],
+        'numeric': [],
+        'integer': ['followers'],
+        'list': [],
+    },
+    'bills': {
+        'columns': ['id', 'phoneId', 'yearMonth', 'baseFee', 'extraFee', 'totalFee',
+                    'rechargeAmount', 'balance', 'createdAt', 'createdBy'],
+        'required': ['phoneId', 'yearMonth'],
+        'numeric': ['baseFee', 'extraFee', 'totalFee', 'rechargeAmount', 'balance'],
+        'integer': [],
+        'list': [],
+    },
+}
+
+# 支持的行格式：CSV（Excel 可直接打开/另存）、TSV（从表格复制粘贴）、JSON Lines
+ROW_FORMATS = {
+    'csv': {'mimetype': 'text/csv', 'delimiter': ','},
+    'tsv': {'mimetype': 'text/tab-separated-values', 'delimiter': '\t'},
+    'jsonl': {'mimetype': 'application/x-ndjson', 'delimiter': None},
+}
+
+PHONE_NUMBER_PATTERN = re.compile(r'^1\d{10}$')
+YEAR_MONTH_PATTERN = re.compile(r'^(\d{4})\D?(\d{1,2})$')
+
+def detect_row_format(filename=None, content_type=None):
+    """根据参数、文件名或Content-Type判断行格式"""
+    fmt = (request.args.get('format') or '').lower()
+    if fmt:
+        return fmt if fmt in ROW_FORMATS else None
+    if filename:
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if ext in ('txt', 'tab'):
+            return 'tsv'
+        if ext in ('ndjson', 'json'):
+            return 'jsonl'
+        if ext in ROW_FORMATS:
+            return ext
+    if content_type:
+        for name, spec in ROW_FORMATS.items():
+            if content_type.startswith(spec['mimetype']):
+                return name
+    return 'csv'
+
+class ReadableStream(io.RawIOBase):
+    """把只提供 read() 的WSGI输入流包装为标准 io 流（gunicorn 的请求体没有 readable()）"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def open_text_stream(raw_stream):
+    """以UTF-8（兼容BOM）文本方式流式读取上传内容"""
+    return io.TextIOWrapper(io.BufferedReader(ReadableStream(raw_stream), 1024 * 1024),
+                            encoding='utf-8-sig', newline='')
+
+def iter_source_rows(text_stream, fmt):
+    """逐行读取上传内容，产出 (行号, 原始字典) ；解析失败的行产出 (行号, 错误信息)"""
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(text_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, f'JSON格式错误: {e}'
+                continue
+            if not isinstance(row, dict):
+                yield line_no, '每行必须是一个JSON对象'
+                continue
+            yield line_no, row
+    else:
+        reader = csv.DictReader(text_stream, delimiter=ROW_FORMATS[fmt]['delimiter'])
+        for row in reader:
+            # 表头占第1行，与表格软件中的行号保持一致
+            line_no = reader.line_num
+            if None in row:
+                yield line_no, '列数多于表头'
+                continue
+            yield line_no, row
+
+def normalize_row(collection, row):
+    """校验并规范化一行数据，返回 (记录, 错误信息)"""
+    schema = COLLECTION_SCHEMAS[collection]
+    record = {}
+    for key, value in row.items():
+        if key is None:
+            continue
+        key = key.strip()
+        if not key:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if value == '':
+                continue
+        elif value is None:
+            continue
+        record[key] = value
+
+    for field in schema['required']:
+        if field not in record:
+            return None, f'缺少必填字段: {field}'
+
+    # float() 接受 nan/inf，写入后会序列化为非法JSON（NaN/Infinity），按无效数字处理
+    for field in schema['numeric']:
+        if field in record:
+            try:
+                number = float(str(record[field]).replace(',', ''))
+            except ValueError:
+                number = None
+            if number is None or not math.isfinite(number):
+                return None, f'字段 {field} 不是有效数字: {record[field]}'
+            record[field] = number
+    for field in schema['integer']:
+        if field in record:
+            try:
+                record[field] = int(float(str(record[field]).replace(',', '')))
+            except (ValueError, OverflowError):
+                return None, f'字段 {field} 不是有效整数: {record[field]}'
+    for field in schema['list']:
+        value = record.get(field)
+        if isinstance(value, str):
+            record[field] = [item.strip() for item in re.split(r'[,;，；|]', value) if item.strip()]
+
+    if collection == 'phones':
+        number = re.sub(r'[\s\-]', '', str(record['number']))
+        if number.startswith('+86'):
+            number = number[3:]
+        if not PHONE_NUMBER_PATTERN.match(number):
+            return None, f'手机号格式错误: {record["number"]}'
+        record['number'] = number
+    elif collection == 'bills':
+        match = YEAR_MONTH_PATTERN.match(str(record['yearMonth']))
+        if not match or not 1 <= int(match.group(2)) <= 12:
+            return None, f'账单月份格式错误: {record["yearMonth"]}'
+        record['yearMonth'] = f'{match.group(1)}-{int(match.group(2)):02d}'
+
+    if 'id' in record:
+        record['id'] = str(record['id'])
+    return record, None
+
+def import_rows(collection, rows, current_user_id, commit=None, progress=None):
+    """按批校验记录，每累计 IMPORT_COMMIT_SIZE 条通过 commit(记录列表) 提交一次，返回导入报告
+
+    commit: 提交已校验的记录，为None时只校验（dryRun）
+    progress: 可选回调，每处理完一批以已处理行数调用一次
+    内存中只保留已有ID集合和未提交的记录；文件中途无法解析时停止，已提交的部分保留
+    """
+    existing_ids = collection_ids(collection)
+    if collection == 'bills':
+        existing_ids.update(archived_bill_ids())
+    created_at = datetime.now().isoformat()
+    prefix = collection[:-1]
+
+    report = {'total': 0, 'imported': 0, 'failed': 0, 'errors': []}
+
+    def fail(line_no, message):
+        report['failed'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'row': line_no, 'message': message})
+
+    pending = []
+
+    def flush(batch, final=False):
+        for line_no, record in batch:
+            record_id = record.get('id')
+            if record_id is None:
+                record_id = generate_id(prefix)
+                record['id'] = record_id
+            if record_id in existing_ids:
+                fail(line_no, f'ID已存在: {record_id}')
+                continue
+            existing_ids.add(record_id)
+            record['createdAt'] = created_at
+            record['createdBy'] = current_user_id
+            report['imported'] += 1
+            if commit:
+                pending.append(record)
+        if pending and (final or len(pending) >= IMPORT_COMMIT_SIZE):
+            commit(pending)
+            pending.clear()
+
+    batch = []
+    try:
+        for line_no, row in rows:
+            report['total'] += 1
+            if isinstance(row, str):
+                fail(line_no, row)
+                continue
+            record, error = normalize_row(collection, row)
+            if error:
+                fail(line_no, error)
+                continue
+            batch.append((line_no, record))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush(batch)
+                batch = []
+                if progress:
+                    progress(report['total'])
+    except (UnicodeDecodeError, csv.Error) as e:
+        report['aborted'] = f'文件解析失败: {str(e)}'
+    flush(batch, final=True)
+
+    report['errorsTruncated'] = report['failed'] > len(report['errors'])
+    return report
+
+def format_cell(value):
+    """导出时把嵌套值转换为单元格文本"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return ','.join(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def iter_export_rows(collection, records, fmt):
+    """流式生成导出内容，每次产出一批文本"""
+    if fmt == 'jsonl':
+        chunk = []
+        for record in records:
+            chunk.append(json.dumps(record, ensure_ascii=False))
+            if len(chunk) >= IMPORT_BATCH_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+        return
+
+    columns = list(COLLECTION_SCHEMAS[collection]['columns'])
+    known = set(columns)
+    for record in records:
+        for key in record:
+            if key not in known:
+                known.add(key)
+                columns.append(key)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=ROW_FORMATS[fmt]['delimiter'], lineterminator='\r\n')
+    # 带BOM便于Excel正确识别UTF-8中文
+    if fmt == 'csv':
+        buffer.write('\ufeff')
+    writer.writerow(columns)
+    for i, record in enumerate(records, start=1):
+        writer.writerow([format_cell(record.get(column)) for column in columns])
+        if i % IMPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def run_import(collection, rows, current_user_id, dry_run, progress=None):
+    """执行导入：逐批写入记录所在分区，全部完成后创建一次备份"""
+    commit = None if dry_run else (lambda records: insert_records(collection, records, backup=False))
+    report = import_rows(collection, rows, current_user_id, commit=commit, progress=progress)
+    report['dryRun'] = dry_run
+    if report['imported'] and not dry_run:
+        after_write()
+    return report
+
+@app.route('/api/<collection>/import', methods=['POST'])
+@token_required
+def import_collection(current_user_id, collection):
+    """批量导入（CSV/TSV/JSON Lines），流式解析，按 IMPORT_BATCH_SIZE 分批校验并提交"""
+    try:
+        if collection not in COLLECTION_SCHEMAS:
+            return jsonify({'message': f'不支持的集合类型: {collection}'}), 400
+
+        upload = request.files.get('file')
+        if upload:
+            fmt = detect_row_format(upload.filename, upload.mimetype)
+            raw_stream = upload.stream
+        else:
+            fmt = detect_row_format(content_type=request.mimetype)
+            raw_stream = request.stream
+        if not fmt:
+            return jsonify({'message': f'不支持的格式: {request.args.get("format")}'}), 400
+
+        dry_run = request.args.get('dryRun') in ('1', 'true')
+
+        # 后台导入：先把上传内容流式落盘，再交给任务执行
+        if request.args.get('async') in ('1', 'true'):
+            upload_path = os.path.join(JOBS_DIR, f"upload_{generate_id('import')}")
+            with open(upload_path, 'wb') as f:
+                shutil.copyfileobj(raw_stream, f, 1024 * 1024)
+            job = submit_job('import', {
+                'collection': collection,
+                'format': fmt,
+                'dryRun': dry_run,
+                'upload': os.path.basename(upload_path)
+            }, current_user_id)
+            return job_accepted(job)
+
+        text_stream = open_text_stream(raw_stream)
+        report = run_import(collection, iter_source_rows(text_stream, fmt), current_user_id, dry_run)
+        if report.get('aborted'):
+            report['message'] = f'{report["aborted"]}，此前已导入 {report["imported"]} 条'
+            return jsonify(report), 400
+        report['message'] = f'导入完成: 成功 {report["imported"]} 条，失败 {report["failed"]} 条'
+        return jsonify(report), 200 if report['imported'] or not report['failed'] else 400
+
+    except Exception as e:
+        return jsonify({'message': f'导入失败: {str(e)}'}), 500
+
+@app.route('/api/<collection>/export', methods=['GET'])
+@token_required
+def export_collection(current_user_id, collection):
+    """导出集合（CSV/TSV/JSON Lines），流式输出"""
+    try:
+        if collection not in COLLECTION_SCHEMAS:
+            return jsonify({'message': f'不支持的集合类型: {collection}'}), 400
+
+        fmt = (request.args.get('format') or 'csv').lower()
+        if fmt not in ROW_FORMATS:
+            return jsonify({'message': f'不支持的格式: {fmt}'}), 400
+
+        if request.args.get('async') in ('1', 'true'):
+            job = submit_job('export', {'collection': collection, 'format': fmt}, current_user_id)
+            return job_accepted(job)
+
+        records = collection_records(collection)
+        filename = f"{collection}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        return Response(
+            stream_with_context(iter_export_rows(collection, records, fmt)),
+            mimetype=f"{ROW_FORMATS[fmt]['mimetype']}; charset=utf-8",
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+
+    except Exception as e:
+        return jsonify({'message': f'导出失败: {str(e)}'}), 500
+
+# ==================== 备份恢复 API ====================
+
+def diff_collection(current, backup, sample_size=20):
+    """比较当前数据与备份中的同一集合（以恢复后的变化为视角）"""
+    current_by_id = {r.get('id'): r for r in current}
+    backup_by_id = {r.get('id'): r for r in backup}
+    added = [i for i in backup_by_id if i not in current_by_id]
+    removed = [i for i in current_by_id if i not in backup_by_id]
+    changed = [i for i, r in backup_by_id.items() if i in current_by_id and current_by_id[i] != r]
+    return {
+        'added': len(added),
+        'removed': len(removed),
+        'changed': len(changed),
+        'unchanged': len(backup_by_id) - len(added) - len(changed),
+        'samples': {
+            'added': added[:sample_size],
+            'removed': removed[:sample_size],
+            'changed': changed[:sample_size]
+        }
+    }
+
+@app.route('/api/admin/backups', methods=['GET'])
+@token_required
+@admin_required
+def get_restore_points(current_user_id):
+    """列出恢复点（仅管理员）"""
+    try:
+        return jsonify(list_restore_points())
+    except Exception as e:
+        return jsonify({'message': f'获取备份列表失败: {str(e)}'}), 500
+
+@app.route('/api/admin/backups/<name>/diff', methods=['GET'])
+@token_required
+@admin_required
+def preview_restore(current_user_id, name):
+    """预览恢复到指定备份后的差异（仅管理员）"""
+    try:
+        backup = read_backup(name)
+        if backup is None:
+            return jsonify({'message': '备份不存在'}), 404
+
+        collection = request.args.get('collection')
+        if collection and collection not in BACKUP_COLLECTIONS:
+            return jsonify({'message': f'不支持的集合类型: {collection}'}), 400
+
+        db = load_database_snapshot()
+        collections = [collection] if collection else BACKUP_COLLECTIONS
+        return jsonify({
+            'name': name,
+            'collections': {c: diff_collection(db.get(c, []), backup.get(c, [])) for c in collections},
+            'settingsChanged': db.get('settings') != backup.get('settings')
+        })
+    except Exception as e:
+        return jsonify({'message': f'预览失败: {str(e)}'}), 500
+
+@app.route('/api/admin/backups/<name>/restore', methods=['POST'])
+@token_required
+@admin_required
+def restore_backup(current_user_id, name):
+    """恢复到指定备份：整库、单个集合或单条记录，一次服务端操作完成，只重写有变化的分区（仅管理员）"""
+    try:
+        backup = read_backup(name)
+        if backup is None:
+            return jsonify({'message': '备份不存在'}), 404
+
+        options = request.get_json(silent=True) or {}
+        collection = options.get('collection')
+        record_id = options.get('id')
+        if collection and collection not in BACKUP_COLLECTIONS:
+            return jsonify({'message': f'不支持的集合类型: {collection}'}), 400
+        if record_id and not collection:
+            return jsonify({'message': '恢复单条记录需要指定集合'}), 400
+
+        if record_id:
+            backup_record = next((r for r in backup.get(collection, []) if r.get('id') == record_id), None)
+            # 单条记录走普通的记录写入路径，只锁定并重写记录所在分区；账单同时查找归档
+            if collection == 'bills':
+                modify = lambda change: modify_bill(record_id, change)
+            else:
+                modify = lambda change: modify_record(collection, record_id, change)
+            if backup_record is None:
+                # 备份时该记录尚不存在，恢复即删除
+                if modify(lambda record: None) is None:
+                    return jsonify({'message': '数据不存在'}), 404
+            elif modify(lambda record: backup_record) is None:
+                insert_record(collection, backup_record)
+            restored = {collection: 1}
+        elif collection:
+            # 持有集合全部分区锁替换，读者看到的要么是恢复前、要么是恢复后的集合
+            replace_collection(collection, backup.get(collection, []))
+            restored = {collection: len(backup.get(collection, []))}
+        else:
+            if not save_database(backup):
+                return jsonify({'message': '保存失败'}), 500
+            restored = {c: len(backup.get(c, [])) for c in BACKUP_COLLECTIONS}
+
+        if 'bills' in restored:
+            # 备份不含归档：恢复的账单以热存储为准，立即归档其中的旧月份并替换归档中的同ID副本
+            archive_old_bills()
+        return jsonify({'message': '恢复成功', 'name': name, 'restored': restored})
+
+    except Exception as e:
+        return jsonify({'message': f'恢复失败: {str(e)}'}), 500
+
+# ==================== 统计 API ====================
+
+STATISTICS_FILE = os.path.join(DATA_DIR, 'statistics.json')
+STATISTICS_COLLECTIONS = ['phones', 'accounts', 'bills']
+
+def build_statistics(db):
+    """汇总仪表盘统计数据"""
+    phones_by_status = {}
+    phones_by_carrier = {}
+    monthly_fee_total = 0
+    for phone in db['phones']:
+        status = phone.get('status') or '未知'
+        carrier = phone.get('carrier') or '未知'
+        phones_by_status[status] = phones_by_status.get(status, 0) + 1
+        phones_by_carrier[carrier] = phones_by_carrier.get(carrier, 0) + 1
+        monthly_fee_total += float(phone.get('monthlyFee') or 0)
+
+    accounts_by_platform = {}
+    for account in db['accounts']:
+        platform = account.get('platform') or '未知'
+        accounts_by_platform[platform] = accounts_by_platform.get(platform, 0) + 1
+
+    bills_by_month = {}
+    bill_fee_total = 0
+    duplicates = archived_duplicates(db['bills'])
+    for bill in db['bills']:
+        month = bills_by_month.setdefault(bill.get('yearMonth') or '未知', {'count': 0, 'totalFee': 0})
+        fee = float(bill.get('totalFee') or 0)
+        month['count'] += 1
+        month['totalFee'] += fee
+        bill_fee_total += fee
+
+    # 归档月份直接取索引中的合计，扣除已回到热存储的重复账单
+    archived_count = 0
+    for ym, info in read_archive_index()['months'].items():
+        duplicate = duplicates.get(ym, {'count': 0, 'totalFee': 0})
+        month = bills_by_month.setdefault(ym, {'count': 0, 'totalFee': 0})
+        month['count'] += info['count'] - duplicate['count']
+        month['totalFee'] += info['totalFee'] - duplicate['totalFee']
+        bill_fee_total += info['totalFee'] - duplicate['totalFee']
+        archived_count += info['count'] - duplicate['count']
+    for month in bills_by_month.values():
+        month['totalFee'] = round(month['totalFee'], 2)
+
+    return {
+        'counts': {c: len(db[c]) for c in ('phones', 'accounts', 'bills')},
+        'phones': {
+            'byStatus': phones_by_status,
+            'byCarrier': phones_by_carrier,
+            'monthlyFeeTotal': round(monthly_fee_total, 2)
+        },
+        'accounts': {'byPlatform': accounts_by_platform},
+        'bills': {
+            'byMonth': dict(sorted(bills_by_month.items())),
+            'totalFee': round(bill_fee_total, 2),
+            'archivedCount': archived_count
+        },
+        'generatedAt': datetime.now().isoformat()
+    }
+
+def rebuild_statistics():
+    """重新计算统计并持久化，附带数据版本供其他worker判断是否过期"""
+    revision = data_revision(STATISTICS_COLLECTIONS)
+    stats = build_statistics(load_database_snapshot())
+    stats['revision'] = revision
+    write_json_atomic(STATISTICS_FILE, stats)
+    return stats
+
+def get_statistics():
+    """读取统计：持久化结果与当前数据版本一致时直接返回，否则重新计算"""
+    revision = data_revision(STATISTICS_COLLECTIONS)
+    try:
+        with open(STATISTICS_FILE, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        if stats.get('revision') == revision:
+            return stats
+    except (OSError, ValueError):
+        pass
+    return rebuild_statistics()
+
+@app.route('/api/statistics', methods=['GET'])
+@token_required
+@single_flight(*STATISTICS_COLLECTIONS)
+def get_statistics_api(current_user_id):
+    """获取仪表盘统计"""
+    try:
+        return jsonify(get_statistics())
+    except Exception as e:
+        return jsonify({'message': f'获取统计失败: {str(e)}'}), 500
+
+# ==================== 账单归档 ====================
+
+# 账单按月份分冷热：早于 BILL_HOT_MONTHS 个月的账单移出热存储，写入按月压缩的只读归档段
+# (archive/bills/YYYY-MM.json.gz)，index.json 记录每个归档月的条数与金额合计。
+# 带月份区间的查询只打开区间覆盖到的归档段，汇总统计只读索引。同一账单在任一时刻以热存储为准：
+# 修改归档账单时写回热存储，下次归档时再按月份归档并替换归档中的旧副本
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive', 'bills')
+ARCHIVE_INDEX_FILE = os.path.join(ARCHIVE_DIR, 'index.json')
+# 最近一次归档检查时间单独存放，索引只在归档内容变化时改写（账单的数据版本包含索引）
+ARCHIVE_STATE_FILE = os.path.join(ARCHIVE_DIR, 'state.json')
+BILL_HOT_MONTHS = int(os.environ.get('BILL_HOT_MONTHS', 24))
+ARCHIVE_CHECK_INTERVAL = int(os.environ.get('ARCHIVE_CHECK_INTERVAL', 3600))
+MONTH_PATTERN = re.compile(r'^\d{4}-\d{2}$')
+
+os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+_archive_cache = {}
+_archive_ids = {}
+_archive_state = {'checkedAt': 0}
+
+def archive_cutoff(today=None):
+    """归档分界月份：早于该月份的账单属于冷数据"""
+    today = today or datetime.now()
+    index = today.year * 12 + today.month - 1 - BILL_HOT_MONTHS
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+def bill_month(bill):
+    """账单月份统一为 YYYY-MM，无法识别时返回None"""
+    match = YEAR_MONTH_PATTERN.match(str(bill.get('yearMonth') or ''))
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        return None
+    return f'{match.group(1)}-{int(match.group(2)):02d}'
+
+def parse_month_range(args):
+    """解析查询参数中的 from/to 月份区间（含两端）"""
+    month_from, month_to = args.get('from') or None, args.get('to') or None
+    for value in (month_from, month_to):
+        if value and not MONTH_PATTERN.match(value):
+            raise ValueError(f'月份格式错误: {value}，应为 YYYY-MM')
+    return month_from, month_to
+
+def month_in_range(month, month_from, month_to):
+    return month is not None and (not month_from or month >= month_from) and (not month_to or month <= month_to)
+
+def archive_segment_path(month):
+    return os.path.join(ARCHIVE_DIR, f'{month}.json.gz')
+
+def read_archive_index():
+    try:
+        with open(ARCHIVE_INDEX_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'months': {}}
+
+def read_archive_checked_at():
+    try:
+        with open(ARCHIVE_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)['checkedAt']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def read_archive_segment(month):
+    """读取一个归档月的账单，按文件签名缓存；调用方不得修改返回值"""
+    path = archive_segment_path(month)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return []
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _archive_cache.get(month)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        records = json.load(f)
+    _archive_cache[month] = (signature, records)
+    return records
+
+def write_archive_segment(index, month, records):
+    """写入一个归档月并更新索引条目，没有账单时删除该月；调用方持有归档锁，并负责保存索引"""
+    path = archive_segment_path(month)
+    if not records:
+        remove_if_exists(path)
+        index['months'].pop(month, None)
+        return
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    content = json.dumps(records, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with gzip.open(temp_file, 'wb') as f:
+        f.write(content)
+    os.replace(temp_file, path)
+    index['months'][month] = {
+        'count': len(records),
+        'totalFee': round(sum(float(r.get('totalFee') or 0) for r in records), 2),
+        'size': os.path.getsize(path),
+        'archivedAt': datetime.now().isoformat()
+    }
+
+def archived_bill_ids():
+    """归档账单ID → (归档月, 金额)。按索引文件签名缓存，只在归档内容变化后重新读取各归档段"""
+    signature = file_signature(ARCHIVE_INDEX_FILE)
+    if _archive_ids.get('signature') != signature or 'ids' not in _archive_ids:
+        ids = {}
+        for month in read_archive_index()['months']:
+            for record in read_archive_segment(month):
+                ids[record.get('id')] = (month, float(record.get('totalFee') or 0))
+        _archive_ids.update(signature=signature, ids=ids)
+    return _archive_ids['ids']
+
+def remove_archived_bills(bill_ids):
+    """从归档段中删除指定ID的账单，返回删除条数；调用方持有归档锁"""
+    archived_ids = archived_bill_ids()
+    months = {archived_ids[i][0] for i in bill_ids if i in archived_ids}
+    if not months:
+        return 0
+    index = read_archive_index()
+    mutations = []
+    removed = 0
+    for month in sorted(months):
+        segment = read_archive_segment(month)
+        records = [r for r in segment if r.get('id') not in bill_ids]
+        removed += len(segment) - len(records)
+        write_archive_segment(index, month, records)
+        mutations.append({'op': 'archive', 'collection': 'bills', 'month': month, 'records': records})
+    write_json_atomic(ARCHIVE_INDEX_FILE, index)
+    log_mutations(mutations)
+    return removed
+
+def clear_archive():
+    """删除全部归档段并清空索引，返回删除的账单条数；调用方持有归档锁"""
+    index = read_archive_index()
+    for month in index['months']:
+        remove_if_exists(archive_segment_path(month))
+    write_json_atomic(ARCHIVE_INDEX_FILE, {'months': {}})
+    log_mutations([{'op': 'archive_clear', 'collection': 'bills'}])
+    return sum(info['count'] for info in index['months'].values())
+
+def archive_old_bills():
+    """把早于分界月份的账单移入归档段，并删除已回到热存储的账单在归档中的旧副本（同一ID以热存储为准）。
+
+    持有归档锁和账单全部分区锁完成读取、写归档和从热存储删除，期间的并发修改会等待而不会被覆盖。
+    先写归档再删热存储，读者在两者之间看到的重复账单按热存储去重
+    """
+    cutoff = archive_cutoff()
+    with partition_lock('_archive'), ExitStack() as stack:
+        names = list_partitions('bills')
+        for name in names:
+            stack.enter_context(partition_lock(name))
+        archived_ids = archived_bill_ids()
+        old = {}
+        moved = set()
+        for name in names:
+            for bill in read_partition(name):
+                month = bill_month(bill)
+                if month is not None and month < cutoff:
+                    old.setdefault(month, []).append(bill)
+                    moved.add(bill.get('id'))
+                elif bill.get('id') in archived_ids:
+                    moved.add(bill.get('id'))
+
+        index = read_archive_index()
+        months = set(old) | {archived_ids[i][0] for i in moved if i in archived_ids}
+        mutations = []
+        for month in sorted(months):
+            records = [r for r in read_archive_segment(month) if r.get('id') not in moved] + old.get(month, [])
+            write_archive_segment(index, month, records)
+            mutations.append({'op': 'archive', 'collection': 'bills', 'month': month, 'records': records})
+        if mutations:
+            write_json_atomic(ARCHIVE_INDEX_FILE, index)
+            log_mutations(mutations)
+        write_json_atomic(ARCHIVE_STATE_FILE, {'checkedAt': time.time()})
+
+        archived = {bill.get('id') for records in old.values() for bill in records}
+        if archived:
+            deletions = []
+            with snapshot_lock(exclusive=True):
+                for name in names:
+                    records = read_partition(name)
+                    kept = [r for r in records if r.get('id') not in archived]
+                    if len(kept) != len(records):
+                        write_partition(name, kept)
+                        deletions.append({'op': 'delete_many', 'collection': 'bills',
+                                          'ids': [r.get('id') for r in records if r.get('id') in archived]})
+            # 日志在整库排他锁外写入（仍持有分区锁）：快照接口先持日志锁再取整库读锁，反过来会死锁
+            log_mutations(deletions)
+    if archived:
+        after_write()
+    return {'cutoff': cutoff, 'archivedMonths': sorted(old), 'archivedCount': len(archived)}
+
+def maybe_archive_bills():
+    """距上次检查超过 ARCHIVE_CHECK_INTERVAL 秒时在后台执行一次归档（从节点的归档来自复制日志）"""
+    if REPLICATION_ROLE == 'follower' or time.time() - _archive_state['checkedAt'] < ARCHIVE_CHECK_INTERVAL:
+        return
+    _archive_state['checkedAt'] = time.time()
+    if time.time() - (read_archive_checked_at() or 0) < ARCHIVE_CHECK_INTERVAL:
+        return
+    get_job_executor().submit(archive_old_bills)
+
+def modify_bill(bill_id, change, owner_hint=None):
+    """修改或删除一条账单，约定同 modify_record。热存储未命中时查找归档：
+    修改后的账单写回热存储（下次归档时按月份重新归档），删除则直接从归档段移除"""
+    old = modify_record('bills', bill_id, change, owner_hint=owner_hint)
+    if old is not None:
+        return old
+    with partition_lock('_archive'):
+        found = archived_bill_ids().get(bill_id)
+        if found is None:
+            return None
+        old = next(r for r in read_archive_segment(found[0]) if r.get('id') == bill_id)
+        new = change(dict(old))
+        if new is not None:
+            insert_record('bills', new)
+        remove_archived_bills({bill_id})
+    return old
+
+def clear_bills():
+    """清空账单及其归档，返回删除条数；归档清空写入复制日志，从节点随之清空"""
+    with partition_lock('_archive'):
+        count = len(load_collection('bills')) + clear_archive()
+        replace_collection('bills', [])
+    return count
+
+def query_bills(month_from=None, month_to=None, include_archive=True):
+    """按月份区间查询账单：只有区间覆盖到的归档月才会被读取；同一ID同时在热存储和归档中时以热存储为准"""
+    hot = load_collection('bills')
+    hot_ids = {bill.get('id') for bill in hot}
+    if month_from or month_to:
+        hot = [bill for bill in hot if month_in_range(bill_month(bill), month_from, month_to)]
+    if not include_archive:
+        return hot
+    archived = []
+    for month in sorted(read_archive_index()['months']):
+        if month_in_range(month, month_from, month_to):
+            archived.extend(r for r in read_archive_segment(month) if r.get('id') not in hot_ids)
+    return archived + hot
+
+def collection_records(collection):
+    """集合的全部记录，账单包括归档（导出、创建时间索引等需要完整数据的地方使用）"""
+    return query_bills() if collection == 'bills' else load_collection(collection)
+
+def archived_duplicates(hot):
+    """同时存在于热存储中的归档账单（以热存储为准），按归档月汇总条数与金额，汇总时从索引合计中扣除"""
+    archived_ids = archived_bill_ids() if read_archive_index()['months'] else {}
+    duplicates = {}
+    for bill in hot:
+        found = archived_ids.get(bill.get('id'))
+        if found:
+            entry = duplicates.setdefault(found[0], {'count': 0, 'totalFee': 0})
+            entry['count'] += 1
+            entry['totalFee'] += found[1]
+    return duplicates
+
+def summarize_bills(month_from=None, month_to=None):
+    """按月汇总账单条数与金额：热数据现算，归档月份取索引合计（扣除已回到热存储的重复账单）"""
+    hot = load_collection('bills')
+    months = {}
+    for bill in hot:
+        month = bill_month(bill)
+        if (month_from or month_to) and not month_in_range(month, month_from, month_to):
+            continue
+        entry = months.setdefault(month or '未知', {'count': 0, 'totalFee': 0})
+        entry['count'] += 1
+        entry['totalFee'] += float(bill.get('totalFee') or 0)
+    duplicates = archived_duplicates(hot)
+    for month, info in read_archive_index()['months'].items():
+        if month_in_range(month, month_from, month_to):
+            duplicate = duplicates.get(month, {'count': 0, 'totalFee': 0})
+            entry = months.setdefault(month, {'count': 0, 'totalFee': 0})
+            entry['count'] += info['count'] - duplicate['count']
+            entry['totalFee'] += info['totalFee'] - duplicate['totalFee']
+    for entry in months.values():
+        entry['totalFee'] = round(entry['totalFee'], 2)
+    return dict(sorted(months.items()))
+
+@app.route('/api/bills/summary', methods=['GET'])
+@token_required
+@single_flight('bills')
+def get_bills_summary(current_user_id):
+    """按月汇总账单（?from=YYYY-MM&to=YYYY-MM），包含归档月份"""
+    try:
+        month_from, month_to = parse_month_range(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    try:
+        months = summarize_bills(month_from, month_to)
+        return jsonify({
+            'byMonth': months,
+            'count': sum(entry['count'] for entry in months.values()),
+            'totalFee': round(sum(entry['totalFee'] for entry in months.values()), 2),
+            'archiveCutoff': archive_cutoff()
+        })
+    except Exception as e:
+        return jsonify({'message': f'获取汇总失败: {str(e)}'}), 500
+
+@app.route('/api/admin/archive', methods=['GET'])
+@token_required
+@admin_required
+def get_archive_status(current_user_id):
+    """归档状态：分界月份及各归档月的条数、金额与文件大小"""
+    index = read_archive_index()
+    return jsonify({
+        'cutoff': archive_cutoff(),
+        'hotMonths': BILL_HOT_MONTHS,
+        'checkedAt': read_archive_checked_at(),
+        'months': dict(sorted(index['months'].items()))
+    })
+
+# ==================== 启动数据 API ====================
+
+# 客户端启动时一次取回设置、各集合第一页（最新在前）、条数与版本号及仪表盘统计。
+# 响应带 ETag（由涉及集合的数据版本和当前用户生成），客户端用 If-None-Match 重新验证，数据未变化时返回304
+BOOTSTRAP_PAGE_SIZE = int(os.environ.get('BOOTSTRAP_PAGE_SIZE', 50))
+BOOTSTRAP_COLLECTIONS = ['phones', 'accounts', 'bills']
+BOOTSTRAP_RETRIES = 3
+
+def bootstrap_revision():
+    """启动数据涉及的集合（各集合、设置）的数据版本号；统计由同样的集合算出"""
+    return data_revision(BOOTSTRAP_COLLECTIONS + ['settings'])
+
+def bootstrap_etag(revision, user, limit):
+    key = f"{revision}:{user['id']}:{user.get('username')}:{user.get('role')}:{limit}"
+    return hashlib.md5(key.encode('utf-8')).hexdigest()[:20]
+
+def assemble_bootstrap(limit):
+    """读取一次启动数据的各部分，返回 (版本号, 设置, 各集合第一页, 统计)"""
+    revision = bootstrap_revision()
+    settings = {'data': read_partition('settings'), 'revision': revision_of(['settings'])}
+    collections = {}
+    for collection in BOOTSTRAP_COLLECTIONS:
+        items, total = query_created_range(collection, limit=limit)
+        has_more = total > len(items)
+        collections[collection] = {
+            'items': items,
+            'count': total,
+            'revision': data_revision([collection]),
+            'hasMore': has_more,
+            # 下一页：/api/<collection>/created?offset=<nextOffset>
+            'nextOffset': len(items) if has_more else None
+        }
+    return revision, settings, collections, get_statistics()
+
+def build_bootstrap(user, limit):
+    """在同一数据版本下组装启动数据：组装前后版本号一致才算一致快照，否则重试。
+    重试次数用完（写入持续不断）时持有归档锁和相关分区锁再组装一次，写入者等待，结果必然一致"""
+    for _ in range(BOOTSTRAP_RETRIES):
+        revision, settings, collections, statistics = assemble_bootstrap(limit)
+        if bootstrap_revision() == revision and statistics.get('revision') == data_revision(STATISTICS_COLLECTIONS):
+            break
+    else:
+        with ExitStack() as stack:
+            # 与归档、写入者相同的加锁顺序：先归档锁，再按名称顺序加分区锁
+            stack.enter_context(partition_lock('_archive'))
+            for name in list_partitions():
+                if partition_collection(name) in BOOTSTRAP_COLLECTIONS + ['settings']:
+                    stack.enter_context(partition_lock(name))
+            revision, settings, collections, statistics = assemble_bootstrap(limit)
+    collections['bills']['archivedCount'] = statistics['bills'].get('archivedCount', 0)
+    return revision, {
+        'revision': revision,
+        'user': {'id': user['id'], 'username': user.get('username'), 'role': user.get('role')},
+        'settings': settings,
+        'collections': collections,
+        'statistics': statistics,
+        'generatedAt': datetime.now().isoformat()
+    }
+
+@app.route('/api/bootstrap', methods=['GET'])
+@token_required
+def get_bootstrap(current_user_id):
+    """启动数据（?limit= 每个集合第一页条数），支持 If-None-Match 条件请求"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', BOOTSTRAP_PAGE_SIZE)), 1000))
+    except ValueError:
+        return jsonify({'message': 'limit 必须是整数'}), 400
+    try:
+        # 先只比较版本号，数据未变化时不读取任何分区内容
+        user = next(u for u in read_partition('users') if u['id'] == current_user_id)
+        etag = bootstrap_etag(bootstrap_revision(), user, limit)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            revision, payload = build_bootstrap(user, limit)
+            response = jsonify(payload)
+            etag = bootstrap_etag(revision, user, limit)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'message': f'获取启动数据失败: {str(e)}'}), 500
+
+# ==================== 后台任务 ====================
+
+# 任务表：每个任务一个JSON文件，所有worker共享；取消通过标记文件传递给执行任务的worker
+# 并发上限通过 JOB_MAX_WORKERS 个槽位锁文件在所有worker之间共享，抢不到槽位的任务保持排队
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
+JOB_SLOT_DIR = os.path.join(JOBS_DIR, 'slots')
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', 2))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+JOB_PROGRESS_INTERVAL = 0.5
+JOB_ID_PATTERN = re.compile(r'^job_[0-9a-f]+$')
+
+os.makedirs(JOB_SLOT_DIR, exist_ok=True)
+
+_job_executor = {'pid': None, 'executor': None}
+
+class JobCancelled(Exception):
+    """任务被取消"""
+
+def get_job_executor():
+    """按进程创建线程池（gunicorn fork后不能沿用父进程的线程池）"""
+    pid = os.getpid()
+    if _job_executor['pid'] != pid:
+        _job_executor.update(pid=pid, executor=ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS))
+    return _job_executor['executor']
+
+def job_path(job_id, suffix='.json'):
+    return os.path.join(JOBS_DIR, job_id + suffix)
+
+@contextmanager
+def job_slot(job_id):
+    """占用一个全局任务槽位（跨worker），等待期间检查取消标记；Windows 下只受进程内线程池限制"""
+    if fcntl is None:
+        if os.path.exists(job_path(job_id, '.cancel')):
+            raise JobCancelled()
+        yield
+        return
+    while True:
+        if os.path.exists(job_path(job_id, '.cancel')):
+            raise JobCancelled()
+        for i in range(JOB_MAX_WORKERS):
+            lock_file = open(os.path.join(JOB_SLOT_DIR, f'slot_{i}.lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+        time.sleep(JOB_PROGRESS_INTERVAL)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def read_job(job_id):
+    """读取任务状态，执行任务的进程已退出时标记为失败"""
+    if not JOB_ID_PATTERN.match(job_id):
+        return None
+    try:
+        with open(job_path(job_id), 'r', encoding='utf-8') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if job['status'] in ('queued', 'running') and not process_alive(job['pid']):
+        job.update(status='failed', message='执行任务的进程已退出', finishedAt=datetime.now().isoformat())
+        write_json_atomic(job_path(job_id), job)
+    return job
+
+def update_job(job_id, **changes):
+    job = read_job(job_id)
+    job.update(changes)
+    write_json_atomic(job_path(job_id), job)
+    return job
+
+def make_job_progress(job_id):
+    """生成进度回调：节流写入进度，并检查取消标记"""
+    state = {'last': 0}
+
+    def progress(processed, total=None):
+        now = time.time()
+        if now - state['last'] < JOB_PROGRESS_INTERVAL:
+            return
+        state['last'] = now
+        if os.path.exists(job_path(job_id, '.cancel')):
+            raise JobCancelled()
+        percent = round(min(processed / total, 1) * 100, 1) if total else None
+        update_job(job_id, processed=processed, total=total, progress=percent)
+
+    return progress
+
+def job_clear_collection(job, params, user_id, progress):
+    progress(0)
+    return {'deletedCount': clear_collection_records(params['collection'])}
+
+def job_backup(job, params, user_id, progress):
+    return create_backup()
+
+def job_export(job, params, user_id, progress):
+    collection, fmt = params['collection'], params['format']
+    records = collection_records(collection)
+    result_file = f"{job['id']}.{fmt}"
+    written = 0
+    with open(os.path.join(JOBS_DIR, result_file), 'w', encoding='utf-8', newline='') as f:
+        for chunk in iter_export_rows(collection, records, fmt):
+            f.write(chunk)
+            written = min(written + IMPORT_BATCH_SIZE, len(records))
+            progress(written, len(records))
+    return {
+        'file': result_file,
+        'filename': f"{collection}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}",
+        'mimetype': ROW_FORMATS[fmt]['mimetype'],
+        'count': len(records)
+    }
+
+def job_import(job, params, user_id, progress):
+    upload_path = os.path.join(JOBS_DIR, params['upload'])
+    try:
+        size = os.path.getsize(upload_path)
+        with open(upload_path, 'rb') as raw:
+            text_stream = open_text_stream(raw)
+            return run_import(params['collection'], iter_source_rows(text_stream, params['format']), user_id,
+                              params['dryRun'], progress=lambda rows: progress(raw.tell(), size))
+    finally:
+        os.remove(upload_path)
+
+def job_statistics(job, params, user_id, progress):
+    return rebuild_statistics()
+
+def job_archive(job, params, user_id, progress):
+    return archive_old_bills()
+
+JOB_TYPES = {
+    'clear': {'handler': job_clear_collection, 'admin': True},
+    'backup': {'handler': job_backup, 'admin': True},
+    'export': {'handler': job_export, 'admin': False},
+    'import': {'handler': job_import, 'admin': False},
+    'statistics': {'handler': job_statistics, 'admin': True},
+    'archive': {'handler': job_archive, 'admin': True},
+}
+
+def run_job(job_id, user_id):
+    """在线程池中执行任务"""
+    try:
+        with job_slot(job_id):
+            job = update_job(job_id, status='running', startedAt=datetime.now().isoformat())
+            result = JOB_TYPES[job['type']]['handler'](job, job['params'], user_id, make_job_progress(job_id))
+            update_job(job_id, status='succeeded', progress=100, result=result,
+                       finishedAt=datetime.now().isoformat())
+    except JobCancelled:
+        update_job(job_id, status='cancelled', finishedAt=datetime.now().isoformat())
+    except Exception as e:
+        update_job(job_id, status='failed', message=str(e), finishedAt=datetime.now().isoformat())
+
+def cleanup_old_jobs():
+    """清理超过保留期的已结束任务及其结果文件"""
+    cutoff = time.time() - JOB_RETENTION_DAYS * 86400
+    for filename in os.listdir(JOBS_DIR):
+        filepath = os.path.join(JOBS_DIR, filename)
+        try:
+            if os.path.getmtime(filepath) < cutoff:
+                os.remove(filepath)
+        except OSError:
+            pass
+
+def submit_job(job_type, params, user_id):
+    """登记任务并提交到线程池，返回任务状态"""
+    cleanup_old_jobs()
+    job = {
+        'id': generate_id('job'),
+        'type': job_type,
+        'params': params,
+        'status': 'queued',
+        'progress': 0,
+        'processed': 0,
+        'total': None,
+        'message': None,
+        'result': None,
+        'createdBy': user_id,
+        'createdAt': datetime.now().isoformat(),
+        'startedAt': None,
+        'finishedAt': None,
+        'pid': os.getpid()
+    }
+    write_json_atomic(job_path(job['id']), job)
+    get_job_executor().submit(run_job, job['id'], user_id)
+    return job
+
+def job_accepted(job):
+    """任务已提交的202响应"""
+    response = jsonify({'id': job['id'], 'status': job['status'], 'message': '任务已提交'})
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+def is_admin(user_id):
+    user = next((u for u in read_partition('users') if u['id'] == user_id), None)
+    return bool(user and user.get('role') == 'admin')
+
+def get_visible_job(job_id, user_id):
+    """读取任务，非管理员只能访问自己提交的任务"""
+    job = read_job(job_id)
+    if job is None or (job['createdBy'] != user_id and not is_admin(user_id)):
+        return None
+    return job
+
+@app.route('/api/jobs', methods=['POST'])
+@token_required
+def create_job(current_user_id):
+    """提交后台任务"""
+    try:
+        data = request.get_json(silent=True) or {}
+        job_type = data.get('type')
+        params = data.get('params') or {}
+
+        if job_type not in JOB_TYPES or job_type == 'import':
+            return jsonify({'message': f'不支持的任务类型: {job_type}'}), 400
+        if JOB_TYPES[job_type]['admin'] and not is_admin(current_user_id):
+            return jsonify({'message': '权限不足'}), 403
+        if job_type in ('clear', 'export') and params.get('collection') not in COLLECTION_SCHEMAS:
+            return jsonify({'message': f'不支持的集合类型: {params.get("collection")}'}), 400
+        if job_type == 'export':
+            params['format'] = (params.get('format') or 'csv').lower()
+            if params['format'] not in ROW_FORMATS:
+                return jsonify({'message': f'不支持的格式: {params["format"]}'}), 400
+
+        return job_accepted(submit_job(job_type, params, current_user_id))
+    except Exception as e:
+        return jsonify({'message': f'提交任务失败: {str(e)}'}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+@token_required
+def get_jobs(current_user_id):
+    """任务列表（新的在前），管理员可见全部任务"""
+    try:
+        admin = is_admin(current_user_id)
+        jobs = []
+        for filename in os.listdir(JOBS_DIR):
+            if not filename.endswith('.json'):
+                continue
+            job = read_job(filename[:-5])
+            if job and (admin or job['createdBy'] == current_user_id):
+                jobs.append(job)
+        jobs.sort(key=lambda j: j['id'], reverse=True)
+        return jsonify(jobs[:100])
+    except Exception as e:
+        return jsonify({'message': f'获取任务列表失败: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(current_user_id, job_id):
+    """查询任务状态与进度"""
+    job = get_visible_job(job_id, current_user_id)
+    if job is None:
+        return jsonify({'message': '任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@token_required
+def cancel_job(current_user_id, job_id):
+    """取消任务（由执行任务的worker在下一次进度检查时停止）"""
+    try:
+        job = get_visible_job(job_id, current_user_id)
+        if job is None:
+            return jsonify({'message': '任务不存在'}), 404
+        if job['status'] not in ('queued', 'running'):
+            return jsonify({'message': f'任务已结束: {job["status"]}'}), 409
+        with open(job_path(job_id, '.cancel'), 'w') as f:
+            f.write(current_user_id)
+        return jsonify({'id': job_id, 'message': '已请求取消'}), 202
+    except Exception as e:
+        return jsonify({'message': f'取消任务失败: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+@token_required
+def get_job_result(current_user_id, job_id):
+    """获取任务结果，导出任务返回文件下载"""
+    job = get_visible_job(job_id, current_user_id)
+    if job is None:
+        return jsonify({'message': '任务不存在'}), 404
+    if job['status'] != 'succeeded':
+        return jsonify({'message': f'任务未完成: {job["status"]}', 'status': job['status']}), 409
+
+    result = job['result'] or {}
+    if job['type'] == 'export':
+        return send_file(os.path.abspath(os.path.join(JOBS_DIR, result['file'])),
+                         mimetype=result['mimetype'], as_attachment=True,
+                         download_name=result['filename'])
+    return jsonify(result)
+
+# ==================== 主从复制 ====================
+
+# 主节点把每次写入追加到变更日志（oplog），从节点拉取日志应用到自己的本地存储并提供读接口。
+# REPLICATION_ROLE: standalone（默认，不记录日志）/ primary / follower
+# 从节点收到的写请求按 REPLICA_WRITE_MODE 转发到主节点（forward）或直接拒绝（reject）
+REPLICATION_ROLE = os.environ.get('REPLICATION_ROLE', 'standalone')
+REPLICATION_PRIMARY_URL = os.environ.get('REPLICATION_PRIMARY_URL', '').rstrip('/')
+REPLICATION_TOKEN = os.environ.get('REPLICATION_TOKEN', '')
+REPLICA_WRITE_MODE = os.environ.get('REPLICA_WRITE_MODE', 'forward')
+REPLICATION_POLL_INTERVAL = float(os.environ.get('REPLICATION_POLL_INTERVAL', 0.5))
+REPLICATION_BATCH_SIZE = 1000
+OPLOG_DIR = os.path.join(DATA_DIR, 'oplog')
+OPLOG_HEAD_FILE = os.path.join(OPLOG_DIR, 'head.json')
+OPLOG_SEGMENT_ENTRIES = 10000
+OPLOG_RETAIN_SEGMENTS = int(os.environ.get('OPLOG_RETAIN_SEGMENTS', 20))
+REPLICATION_STATE_FILE = os.path.join(DATA_DIR, 'replication.json')
+# 从节点上这些路径的数据只存在于主节点，任何方法都转发
+FOLLOWER_FORWARD_PREFIXES = ('/api/jobs', '/api/admin/')
+# 剖析结果和慢请求记录按节点保存，从节点上查看的是本节点的数据，不转发
+FOLLOWER_LOCAL_PREFIXES = ('/api/admin/profiles',)
+
+os.makedirs(OPLOG_DIR, exist_ok=True)
+
+_replication_state = {'pid': None}
+
+def oplog_segment_path(index):
+    return os.path.join(OPLOG_DIR, f'oplog_{index:08d}.jsonl')
+
+def read_oplog_head():
+    try:
+        with open(OPLOG_HEAD_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)['seq']
+    except (OSError, ValueError):
+        return 0
+
+def oldest_oplog_seq():
+    """日志中仍保留的最小序号"""
+    segments = sorted(f for f in os.listdir(OPLOG_DIR) if f.startswith('oplog_'))
+    if not segments:
+        return read_oplog_head() + 1
+    return int(segments[0][6:14]) * OPLOG_SEGMENT_ENTRIES + 1
+
+def log_mutations(mutations):
+    """主节点追加变更日志；调用方持有相关分区锁，保证同一分区的日志顺序与写入顺序一致"""
+    if REPLICATION_ROLE != 'primary' or not mutations:
+        return
+    with partition_lock('_oplog'), phase('oplog'):
+        seq = read_oplog_head()
+        now = time.time()
+        lines = {}
+        for mutation in mutations:
+            seq += 1
+            entry = {'seq': seq, 'ts': now, **mutation}
+            lines.setdefault((seq - 1) // OPLOG_SEGMENT_ENTRIES, []).append(
+                json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+        for index, segment_lines in lines.items():
+            with open(oplog_segment_path(index), 'a', encoding='utf-8') as f:
+                f.write('\n'.join(segment_lines) + '\n')
+        write_json_atomic(OPLOG_HEAD_FILE, {'seq': seq})
+
+        # 只保留最近的若干个日志段，落后太多的从节点改为全量同步
+        current = (seq - 1) // OPLOG_SEGMENT_ENTRIES
+        for filename in os.listdir(OPLOG_DIR):
+            if filename.startswith('oplog_') and int(filename[6:14]) <= current - OPLOG_RETAIN_SEGMENTS:
+                remove_if_exists(os.path.join(OPLOG_DIR, filename))
+
+def iter_oplog(after, limit):
+    """读取序号大于 after 的日志，最多 limit 条"""
+    head = read_oplog_head()
+    index = after // OPLOG_SEGMENT_ENTRIES
+    count = 0
+    while count < limit and index * OPLOG_SEGMENT_ENTRIES < head:
+        try:
+            with open(oplog_segment_path(index), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 正在追加的最后一行
+                        return
+                    if entry['seq'] > head:
+                        return
+                    if entry['seq'] <= after:
+                        continue
+                    yield entry
+                    count += 1
+                    if count >= limit:
+                        return
+        except FileNotFoundError:
+            return
+        index += 1
+
+def apply_mutations(entries):
+    """从节点应用一批日志：每个受影响的分区只重写一次。日志应用是幂等的，重复应用同一条不会出错"""
+    touched = {}
+
+    def records_of(name):
+        if name not in touched:
+            touched[name] = list(read_partition(name))
+        return touched[name]
+
+    def remove_by_id(collection, record_id):
+        for name in list_partitions(collection) + [n for n in touched if partition_collection(n) == collection]:
+            records = records_of(name)
+            for i, record in enumerate(records):
+                if record.get('id') == record_id:
+                    records.pop(i)
+                    return
+
+    def remove_ids(collection, ids):
+        """批量删除：每个分区只扫描一次"""
+        for name in set(list_partitions(collection) + [n for n in touched if partition_collection(n) == collection]):
+            records = records_of(name)
+            if any(record.get('id') in ids for record in records):
+                touched[name] = [record for record in records if record.get('id') not in ids]
+
+    for entry in entries:
+        collection = entry['collection']
+        if entry['op'] == 'archive':
+            with partition_lock('_archive'):
+                index = read_archive_index()
+                write_archive_segment(index, entry['month'], entry['records'])
+                write_json_atomic(ARCHIVE_INDEX_FILE, index)
+        elif entry['op'] == 'archive_clear':
+            with partition_lock('_archive'):
+                for month in read_archive_index()['months']:
+                    remove_if_exists(archive_segment_path(month))
+                write_json_atomic(ARCHIVE_INDEX_FILE, {'months': {}})
+        elif entry['op'] == 'delete_many':
+            remove_ids(collection, set(entry['ids']))
+        elif entry['op'] == 'replace':
+            if collection == 'settings':
+                touched['settings'] = entry['data']
+                continue
+            parts = split_partitions({collection: entry['data'] or []})
+            for name in list_partitions(collection) + list(touched):
+                if partition_collection(name) == collection:
+                    touched[name] = []
+            for name, value in parts.items():
+                if partition_collection(name) == collection:
+                    touched[name] = list(value)
+        elif entry['op'] == 'insert_many':
+            remove_ids(collection, {record.get('id') for record in entry['records']})
+            for record in entry['records']:
+                records_of(partition_of(collection, record)).append(record)
+        else:
+            remove_by_id(collection, entry.get('id') or entry['record'].get('id'))
+            if entry['op'] in ('insert', 'update'):
+                records_of(partition_of(collection, entry['record'])).append(entry['record'])
+
+    with ExitStack() as stack:
+        for name in sorted(touched):
+            stack.enter_context(partition_lock(name))
+        with snapshot_lock(exclusive=True):
+            for name, value in touched.items():
+                write_partition(name, value)
+
+def read_replication_state():
+    try:
+        with open(REPLICATION_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'appliedSeq': None, 'headSeq': None, 'lastAppliedTs': None,
+                'lastContactAt': None, 'lastError': None}
+
+def primary_request(path, timeout=30):
+    """以复制令牌请求主节点"""
+    req = urllib.request.Request(REPLICATION_PRIMARY_URL + path,
+                                 headers={'X-Replication-Token': REPLICATION_TOKEN})
+    return urllib.request.urlopen(req, timeout=timeout)
+
+def resync_from_primary(state):
+    """全量同步：拉取主节点快照替换本地全部数据"""
+    with primary_request('/api/replication/snapshot', timeout=300) as resp:
+        snapshot = json.load(resp)
+    # 先清空本地归档，主节点上已不存在的归档月不会残留
+    entries = [{'op': 'archive_clear', 'collection': 'bills'}]
+    entries += [{'op': 'archive', 'collection': 'bills', 'month': month, 'records': records}
+                for month, records in snapshot.get('archive', {}).items()]
+    entries += [{'op': 'replace', 'collection': c, 'data': snapshot['data'].get(c)}
+                for c in LIST_COLLECTIONS + ['settings']]
+    apply_mutations(entries)
+    state.update(appliedSeq=snapshot['seq'], headSeq=snapshot['seq'], lastAppliedTs=time.time())
+
+def replicate_once(state):
+    """拉取并应用一批日志，返回本批条数"""
+    if state['appliedSeq'] is None:
+        resync_from_primary(state)
+    try:
+        resp = primary_request(f"/api/replication/oplog?after={state['appliedSeq']}&limit={REPLICATION_BATCH_SIZE}")
+    except urllib.error.HTTPError as e:
+        if e.code == 410:
+            # 需要的日志已被清理，改为全量同步
+            resync_from_primary(state)
+            return 0
+        raise
+    with resp:
+        header = json.loads(resp.readline())
+        entries = [json.loads(line) for line in resp if line.strip()]
+    if entries:
+        apply_mutations(entries)
+        state.update(appliedSeq=entries[-1]['seq'], lastAppliedTs=entries[-1]['ts'])
+    state.update(headSeq=header['headSeq'], lastContactAt=time.time(), lastError=None)
+    return len(entries)
+
+def replication_loop(lock_file):
+    """从节点复制线程：持有复制锁的进程负责拉取并应用日志"""
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    state = read_replication_state()
+    while True:
+        try:
+            applied = replicate_once(state)
+        except Exception as e:
+            state['lastError'] = str(e)
+            applied = 0
+        write_json_atomic(REPLICATION_STATE_FILE, state)
+        if applied < REPLICATION_BATCH_SIZE:
+            time.sleep(REPLICATION_POLL_INTERVAL)
+
+def start_replication():
+    """从节点启动复制线程（每个进程一次，多个worker中只有拿到锁的一个真正执行）"""
+    if REPLICATION_ROLE != 'follower' or fcntl is None or _replication_state['pid'] == os.getpid():
+        return
+    _replication_state['pid'] = os.getpid()
+    lock_file = open(os.path.join(DATA_DIR, 'replication.lock'), 'a')
+    threading.Thread(target=replication_loop, args=(lock_file,), daemon=True).start()
+
+def replication_status():
+    """复制状态与延迟"""
+    if REPLICATION_ROLE == 'follower':
+        state = read_replication_state()
+        lag = None
+        if state['appliedSeq'] is not None and state['headSeq'] is not None:
+            lag = max(state['headSeq'] - state['appliedSeq'], 0)
+        return {
+            'role': 'follower',
+            'primary': REPLICATION_PRIMARY_URL,
+            'appliedSeq': state['appliedSeq'],
+            'headSeq': state['headSeq'],
+            'lagEntries': lag,
+            # 已追平时延迟为0，否则为最后应用的日志至今的时间
+            'lagSeconds': 0 if lag == 0 else (round(time.time() - state['lastAppliedTs'], 3)
+                                              if state['lastAppliedTs'] else None),
+            'lastContactAt': state['lastContactAt'],
+            'lastError': state['lastError']
+        }
+    return {
+        'role': REPLICATION_ROLE,
+        'headSeq': read_oplog_head(),
+        'oldestSeq': oldest_oplog_seq()
+    }
+
+def replication_token_valid():
+    token = request.headers.get('X-Replication-Token')
+    return bool(REPLICATION_TOKEN) and token is not None and hmac.compare_digest(token, REPLICATION_TOKEN)
+
+def forward_to_primary():
+    """把请求原样转发给主节点并返回其响应"""
+    url = REPLICATION_PRIMARY_URL + request.full_path.rstrip('?')
+    headers = {k: v for k, v in request.headers.items()
+               if k.lower() in ('authorization', 'content-type', 'content-length', 'if-none-match')}
+    body = request.stream if request.content_length else None
+    req = urllib.request.Request(url, data=body, headers=headers, method=request.method)
+    try:
+        resp = urllib.request.urlopen(req, timeout=120)
+    except urllib.error.HTTPError as e:
+        resp = e
+    with resp:
+        content = resp.read()
+        response = Response(content, status=resp.status, content_type=resp.headers.get('Content-Type'))
+        for header in ('Location', 'Content-Disposition', 'ETag'):
+            if resp.headers.get(header):
+                response.headers[header] = resp.headers[header]
+    response.headers['X-Forwarded-To-Primary'] = '1'
+    return response
+
+start_replication()
+
+@app.before_request
+def route_follower_writes():
+    """从节点：写请求转发到主节点或拒绝，读请求由本地数据提供"""
+    if REPLICATION_ROLE != 'follower':
+        return None
+    start_replication()
+    path = request.path
+    if not path.startswith('/api/') or path.startswith('/api/replication/'):
+        return None
+    if request.method in ('GET', 'HEAD', 'OPTIONS') and (
+            path.startswith(FOLLOWER_LOCAL_PREFIXES) or not path.startswith(FOLLOWER_FORWARD_PREFIXES)):
+        return None
+    if REPLICA_WRITE_MODE == 'forward' and REPLICATION_PRIMARY_URL:
+        try:
+            return forward_to_primary()
+        except Exception as e:
+            return jsonify({'message': f'转发到主节点失败: {str(e)}'}), 502
+    response = jsonify({'message': '当前节点为只读从节点，请将写请求发送到主节点'})
+    response.status_code = 503
+    response.headers['X-Replication-Primary'] = REPLICATION_PRIMARY_URL
+    return response
+
+@app.route('/api/replication/oplog', methods=['GET'])
+def get_oplog():
+    """主节点：以 JSON Lines 流式返回序号大于 after 的变更日志，首行为日志头信息"""
+    if REPLICATION_ROLE != 'primary' or not replication_token_valid():
+        return jsonify({'message': '权限不足'}), 403
+    try:
+        after = int(request.args.get('after', 0))
+        limit = max(1, min(int(request.args.get('limit', REPLICATION_BATCH_SIZE)), 10000))
+    except ValueError:
+        return jsonify({'message': 'after/limit 必须是整数'}), 400
+    if after + 1 < oldest_oplog_seq():
+        return jsonify({'message': '所需日志已清理，请全量同步'}), 410
+
+    def generate():
+        yield json.dumps({'headSeq': read_oplog_head()}) + '\n'
+        for entry in iter_oplog(after, limit):
+            yield json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/replication/snapshot', methods=['GET'])
+def get_replication_snapshot():
+    """主节点：返回整库快照及其对应的日志序号"""
+    if REPLICATION_ROLE != 'primary' or not replication_token_valid():
+        return jsonify({'message': '权限不足'}), 403
+    # 持有日志锁读取：快照至少包含序号之前的全部写入；之后的日志重复应用也是幂等的
+    with partition_lock('_oplog'):
+        seq = read_oplog_head()
+        data = load_database()
+        archive = {month: read_archive_segment(month) for month in read_archive_index()['months']}
+    return jsonify({'seq': seq, 'data': data, 'archive': archive})
+
+@app.route('/api/replication/status', methods=['GET'])
+def get_replication_status():
+    """复制状态（复制令牌或管理员）"""
+    if not replication_token_valid() and not is_admin(request_user_id()):
+        return jsonify({'message': '权限不足'}), 403
+    return jsonify(replication_status())
+
+# ==================== 性能剖析 ====================
+
+# 慢请求：耗时超过 SLOW_REQUEST_MS 的请求记录日志及分阶段耗时（0 表示关闭）。
+# 剖析：管理员请求带 X-Profile 头（cpu/memory/all）时对该请求做 cProfile/tracemalloc 采集，
+# 或按 PROFILE_SAMPLE_RATE 比例抽样做 cProfile 采集；结果保存在 profiles 目录，可由管理员下载
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+SLOW_LOG_FILE = os.path.join(PROFILE_DIR, 'slow.jsonl')
+SLOW_LOG_MAX_BYTES = 1024 * 1024
+PROFILE_TOP_N = 40
+PROFILE_ID_PATTERN = re.compile(r'^prof_[0-9_]+$')
+PROFILE_MODES = ('cpu', 'memory', 'all')
+
+os.makedirs(PROFILE_DIR, exist_ok=True)
+
+# tracemalloc 是进程级的，同一时刻只允许一个请求做内存采集
+_tracemalloc_lock = threading.Lock()
+
+class ProfiledJSONProvider(app.json_provider_class):
+    """把 jsonify 的序列化耗时计入 jsonify 阶段"""
+    def response(self, *args, **kwargs):
+        with phase('jsonify'):
+            return super().response(*args, **kwargs)
+
+app.json = ProfiledJSONProvider(app)
+
+def profile_mode():
+    """本次请求的剖析方式：请求头触发需要管理员令牌，否则按比例抽样"""
+    mode = request.headers.get('X-Profile')
+    if mode:
+        mode = mode.lower() if mode.lower() in PROFILE_MODES else 'cpu'
+        return (mode, 'header') if is_admin(request_user_id()) else (None, None)
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'cpu', 'sample'
+    return None, None
+
+def phase_breakdown(timings):
+    return {name: {'ms': round(seconds * 1000, 2), 'count': count}
+            for name, (seconds, count) in sorted(timings.items(), key=lambda item: -item[1][0])}
+
+def save_profile(profiler, memory, duration_ms, response, trigger):
+    """保存剖析结果：.prof 为 cProfile 原始数据，.json 为元数据与摘要"""
+    now = datetime.now()
+    profile_id = f"prof_{now.strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}"
+    meta = {
+        'id': profile_id,
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('utf-8', 'replace'),
+        'status': response.status_code,
+        'durationMs': round(duration_ms, 2),
+        'trigger': trigger,
+        'phases': phase_breakdown(g.phase_timings),
+        'createdAt': now.isoformat(),
+        'cpu': None,
+        'memory': memory
+    }
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(PROFILE_DIR, profile_id + '.prof'))
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+        meta['cpu'] = out.getvalue()
+    write_json_atomic(os.path.join(PROFILE_DIR, profile_id + '.json'), meta)
+
+    # 只保留最近的若干份
+    dumps = sorted(f[:-5] for f in os.listdir(PROFILE_DIR) if PROFILE_ID_PATTERN.match(f[:-5]) and f.endswith('.json'))
+    for old_id in dumps[:-PROFILE_KEEP]:
+        remove_if_exists(os.path.join(PROFILE_DIR, old_id + '.json'))
+        remove_if_exists(os.path.join(PROFILE_DIR, old_id + '.prof'))
+    return profile_id
+
+def log_slow_request(duration_ms, status, timings):
+    """记录慢请求日志，附分阶段耗时"""
+    phases = phase_breakdown(timings)
+    summary = ' '.join(f"{name}={info['ms']}ms×{info['count']}" for name, info in phases.items())
+    app.logger.warning(f'慢请求 {request.method} {request.full_path.rstrip("?")} '
+                       f'{duration_ms:.0f}ms 状态 {status} 阶段: {summary or "无"}')
+    entry = {
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('utf-8', 'replace'),
+        'status': status,
+        'durationMs': round(duration_ms, 2),
+        'phases': phases,
+        'pid': os.getpid(),
+        'at': datetime.now().isoformat()
+    }
+    try:
+        if os.path.exists(SLOW_LOG_FILE) and os.path.getsize(SLOW_LOG_FILE) > SLOW_LOG_MAX_BYTES:
+            os.replace(SLOW_LOG_FILE, SLOW_LOG_FILE + '.1')
+        with open(SLOW_LOG_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"写入慢请求日志失败: {e}")
+
+@app.before_request
+def start_request_profiling():
+    """开始分阶段计时，按需启动 cProfile/tracemalloc；都未开启时不做任何事"""
+    mode, trigger = profile_mode()
+    if not mode and not SLOW_REQUEST_MS:
+        return None
+    g.phase_timings = _phase_state.timings = {}
+    g.profile_trigger = trigger
+    g.profiler = None
+    g.tracing = False
+    if mode in ('cpu', 'all'):
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:
+            # 同一线程已有其他剖析器在运行
+            g.profiler = None
+    if mode in ('memory', 'all') and not tracemalloc.is_tracing() and _tracemalloc_lock.acquire(blocking=False):
+        tracemalloc.start()
+        g.tracing = True
+    g.request_started = time.perf_counter()
+    return None
+
+@app.after_request
+def finish_request_profiling(response):
+    """结束计时：记录慢请求，保存剖析结果并在响应头中返回剖析ID"""
+    timings = getattr(_phase_state, 'timings', None)
+    if timings is None or 'request_started' not in g:
+        return response
+    _phase_state.timings = None
+    duration_ms = (time.perf_counter() - g.request_started) * 1000
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    memory = None
+    if g.pop('tracing', False):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _tracemalloc_lock.release()
+        memory = {
+            'currentBytes': current,
+            'peakBytes': peak,
+            'top': [{'location': str(stat.traceback), 'sizeBytes': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics('lineno')[:PROFILE_TOP_N]]
+        }
+
+    if SLOW_REQUEST_MS and duration_ms >= SLOW_REQUEST_MS:
+        log_slow_request(duration_ms, response.status_code, timings)
+    if g.profile_trigger:
+        response.headers['X-Profile-Id'] = save_profile(profiler, memory, duration_ms, response, g.profile_trigger)
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={seconds * 1000:.2f}" for name, (seconds, count) in timings.items())
+    return response
+
+@app.teardown_request
+def stop_request_profiling(exc):
+    """请求异常结束时也要停止剖析，避免计时状态泄漏到同一线程的下一个请求"""
+    _phase_state.timings = None
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    if g.pop('tracing', False):
+        tracemalloc.stop()
+        _tracemalloc_lock.release()
+
+def read_profile(profile_id):
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, profile_id + '.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@token_required
+@admin_required
+def get_profiles(current_user_id):
+    """剖析结果列表（最新在前，不含摘要正文）"""
+    try:
+        ids = sorted((f[:-5] for f in os.listdir(PROFILE_DIR)
+                      if f.endswith('.json') and PROFILE_ID_PATTERN.match(f[:-5])), reverse=True)
+        profiles = []
+        for profile_id in ids:
+            meta = read_profile(profile_id)
+            if meta:
+                meta['hasCpu'] = meta.pop('cpu') is not None
+                meta['hasMemory'] = meta.pop('memory') is not None
+                profiles.append(meta)
+        return jsonify(profiles)
+    except Exception as e:
+        return jsonify({'message': f'获取剖析结果失败: {str(e)}'}), 500
+
+@app.route('/api/admin/profiles/slow', methods=['GET'])
+@token_required
+@admin_required
+def get_slow_requests(current_user_id):
+    """最近的慢请求记录（?limit=，默认100条，最新在前）"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+    except ValueError:
+        return jsonify({'message': 'limit 必须是整数'}), 400
+    entries = []
+    for path in (SLOW_LOG_FILE, SLOW_LOG_FILE + '.1'):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+            if len(entries) >= limit:
+                return jsonify(entries)
+    return jsonify(entries)
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@token_required
+@admin_required
+def get_profile(current_user_id, profile_id):
+    """单个剖析结果：分阶段耗时、cProfile 摘要、内存分配前N位"""
+    meta = read_profile(profile_id)
+    if not meta:
+        return jsonify({'message': '剖析结果不存在'}), 404
+    return jsonify(meta)
+
+@app.route('/api/admin/profiles/<profile_id>/download', methods=['GET'])
+@token_required
+@admin_required
+def download_profile(current_user_id, profile_id):
+    """下载 cProfile 原始数据（可用 pstats/snakeviz 打开）"""
+    if not read_profile(profile_id) or not os.path.exists(os.path.join(PROFILE_DIR, profile_id + '.prof')):
+        return jsonify({'message': '剖析结果不存在或没有CPU数据'}), 404
+    return send_file(os.path.join(PROFILE_DIR, profile_id + '.prof'), as_attachment=True,
+                     download_name=profile_id + '.prof', mimetype='application/octet-stream')
+
 # ==================== 静态文件服务 ====================
 
 @app.route('/')
@@ -538,6 +3179,7 @@ def init_database():
 if __name__ == '__main__':
     # 初始化数据库
     init_database()
+    start_replication()
     
     # Railway会设置PORT环境变量
     port = int(os.environ.get('PORT', 5001))
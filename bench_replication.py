@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+主从复制读扩展基准测试
+
+在本机不同端口启动一个主节点和若干从节点，向主节点导入测试数据，
+等待从节点追平后对读接口压测，比较不同从节点数量下的读吞吐。
+
+用法:
+    python bench_replication.py --followers 0 1 2 3 --records 20000 --duration 10
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from multiprocessing import Pool
+
+BASE_PORT = 5200
+REPLICATION_TOKEN = 'bench-replication-token'
+SECRET_KEY = 'bench-secret-key'
+TEST_USER = {"username": "admin", "password": "admin123"}
+
+def request(url, data=None, headers=None, method=None):
+    """发送请求并返回 (状态码, 响应体)"""
+    req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def start_node(port, role, data_dir, primary_url=None, use_gunicorn=True):
+    """启动一个节点进程"""
+    env = {
+        **os.environ,
+        'RAILWAY_VOLUME_MOUNT_PATH': data_dir,
+        'PORT': str(port),
+        'SECRET_KEY': SECRET_KEY,
+        'REPLICATION_ROLE': role,
+        'REPLICATION_TOKEN': REPLICATION_TOKEN,
+        'REPLICATION_POLL_INTERVAL': '0.2',
+        'FLASK_ENV': 'production',
+    }
+    if primary_url:
+        env['REPLICATION_PRIMARY_URL'] = primary_url
+    if use_gunicorn:
+        cmd = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', '1', '--threads', '4', '--timeout', '120']
+    else:
+        cmd = [sys.executable, 'app.py']
+    return subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_for_health(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = request(f'http://127.0.0.1:{port}/api/health')
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+def wait_for_catch_up(primary_port, follower_ports, timeout=120):
+    """等待所有从节点追平主节点的日志"""
+    headers = {'X-Replication-Token': REPLICATION_TOKEN}
+    _, body = request(f'http://127.0.0.1:{primary_port}/api/replication/status', headers=headers)
+    head = json.loads(body)['headSeq']
+    deadline = time.time() + timeout
+    pending = set(follower_ports)
+    while pending and time.time() < deadline:
+        for port in list(pending):
+            _, body = request(f'http://127.0.0.1:{port}/api/replication/status', headers=headers)
+            status = json.loads(body)
+            if status['appliedSeq'] is not None and status['appliedSeq'] >= head:
+                pending.discard(port)
+        time.sleep(0.2)
+    return not pending
+
+def client_worker(args):
+    """压测进程：在指定时长内轮流请求各读节点，返回 (请求数, 失败数, 总耗时)"""
+    urls, token, duration = args
+    headers = {'Authorization': f'Bearer {token}'}
+    count = errors = 0
+    latency = 0.0
+    deadline = time.time() + duration
+    i = 0
+    while time.time() < deadline:
+        start = time.time()
+        try:
+            status, _ = request(urls[i % len(urls)], headers=headers)
+            if status != 200:
+                errors += 1
+        except OSError:
+            errors += 1
+        latency += time.time() - start
+        count += 1
+        i += 1
+    return count, errors, latency
+
+def run_cluster(follower_count, records, duration, clients, path, use_gunicorn):
+    """启动集群、导入数据并压测，返回结果字典"""
+    dirs = [tempfile.mkdtemp(prefix='bench_node_') for _ in range(follower_count + 1)]
+    primary_port = BASE_PORT
+    follower_ports = [BASE_PORT + i + 1 for i in range(follower_count)]
+    primary_url = f'http://127.0.0.1:{primary_port}'
+    nodes = [start_node(primary_port, 'primary', dirs[0], use_gunicorn=use_gunicorn)]
+    try:
+        if not wait_for_health(primary_port):
+            raise RuntimeError('主节点启动失败')
+
+        _, body = request(f'{primary_url}/api/auth/login', data=json.dumps(TEST_USER).encode(),
+                          headers={'Content-Type': 'application/json'})
+        token = json.loads(body)['token']
+
+        rows = '\n'.join(f'1{3000000000 + i},中国移动,{i % 200}' for i in range(records))
+        status, body = request(f'{primary_url}/api/phones/import',
+                               data=('number,carrier,monthlyFee\n' + rows).encode('utf-8'),
+                               headers={'Authorization': f'Bearer {token}', 'Content-Type': 'text/csv'})
+        if status != 200:
+            raise RuntimeError(f'导入测试数据失败: {status} {body[:200]}')
+
+        for port, data_dir in zip(follower_ports, dirs[1:]):
+            nodes.append(start_node(port, 'follower', data_dir, primary_url, use_gunicorn))
+        for port in follower_ports:
+            if not wait_for_health(port):
+                raise RuntimeError(f'从节点 {port} 启动失败')
+        if not wait_for_catch_up(primary_port, follower_ports):
+            raise RuntimeError('从节点未能在限定时间内追平')
+
+        # 有从节点时读流量全部打到从节点，否则打到主节点
+        read_ports = follower_ports or [primary_port]
+        urls = [f'http://127.0.0.1:{port}{path}' for port in read_ports]
+        with Pool(clients) as pool:
+            results = pool.map(client_worker, [(urls[i:] + urls[:i], token, duration) for i in range(clients)])
+
+        total = sum(r[0] for r in results)
+        errors = sum(r[1] for r in results)
+        latency = sum(r[2] for r in results)
+        return {
+            'followers': follower_count,
+            'requests': total,
+            'errors': errors,
+            'rps': total / duration,
+            'avgLatencyMs': latency / total * 1000 if total else 0
+        }
+    finally:
+        for node in nodes:
+            node.terminate()
+        for node in nodes:
+            node.wait()
+        for data_dir in dirs:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='主从复制读扩展基准测试')
+    parser.add_argument('--followers', type=int, nargs='+', default=[0, 1, 2, 3], help='要测试的从节点数量')
+    parser.add_argument('--records', type=int, default=20000, help='导入的手机号码条数')
+    parser.add_argument('--duration', type=float, default=10, help='每轮压测时长（秒）')
+    parser.add_argument('--clients', type=int, default=8, help='压测进程数')
+    parser.add_argument('--path', default='/api/phones', help='压测的读接口')
+    parser.add_argument('--no-gunicorn', action='store_true', help='使用 python app.py 启动节点')
+    args = parser.parse_args()
+
+    print("========================================")
+    print("  主从复制读扩展基准测试")
+    print("========================================")
+    print(f"CPU核数: {os.cpu_count()}  数据量: {args.records}  压测进程: {args.clients}  时长: {args.duration}s")
+    print()
+
+    results = []
+    for count in args.followers:
+        result = run_cluster(count, args.records, args.duration, args.clients, args.path,
+                             not args.no_gunicorn)
+        results.append(result)
+        print(f"从节点 {result['followers']}: {result['rps']:.1f} req/s, "
+              f"平均延迟 {result['avgLatencyMs']:.1f} ms, 失败 {result['errors']}")
+
+    base = results[0]['rps'] or 1
+    print()
+    print("| 从节点数 | 吞吐 (req/s) | 相对第一行 | 平均延迟 (ms) |")
+    print("|----------|--------------|------------|---------------|")
+    for result in results:
+        print(f"| {result['followers']} | {result['rps']:.1f} | {result['rps'] / base:.2f}x | "
+              f"{result['avgLatencyMs']:.1f} |")
+
+if __name__ == '__main__':
+    main()
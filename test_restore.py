@@ -193,5 +193,63 @@ def test_restore_simulation():
     
     return success
 
+def test_point_in_time_restore():
+    """测试服务端按备份恢复（列出恢复点、预览差异、原子恢复）"""
+    print()
+    print("========================================")
+    print("  服务端备份恢复测试")
+    print("========================================")
+    print()
+    
+    token = get_token()
+    if not token:
+        print("❌ 获取认证令牌失败")
+        return False
+    
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+    
+    # 1. 列出恢复点
+    response = requests.get(f"{BASE_URL}/admin/backups", headers=headers)
+    if response.status_code != 200 or not response.json():
+        print(f"❌ 获取恢复点失败: {response.status_code}")
+        return False
+    points = response.json()
+    target = points[0]
+    print(f"📋 共 {len(points)} 个恢复点，最新: {target['name']} ({target['size']} 字节)")
+    
+    # 2. 添加一条临时数据，再预览恢复差异
+    temp_phone = {"number": "13800138099", "carrier": "中国移动", "notes": "恢复测试临时数据"}
+    response = requests.post(f"{BASE_URL}/phones", headers=headers, data=json.dumps(temp_phone))
+    if response.status_code != 201:
+        print(f"❌ 添加临时数据失败: {response.status_code}")
+        return False
+    
+    diff = requests.get(f"{BASE_URL}/admin/backups/{target['name']}/diff", headers=headers).json()
+    removed = diff['collections']['phones']['removed']
+    print(f"🔍 恢复后将移除手机号码: {removed} 条")
+    
+    # 3. 原子恢复整库
+    response = requests.post(f"{BASE_URL}/admin/backups/{target['name']}/restore", headers=headers)
+    if response.status_code != 200:
+        print(f"❌ 恢复失败: {response.status_code}")
+        return False
+    
+    phones = requests.get(f"{BASE_URL}/phones", headers=headers).json()
+    success = removed == 1 and (target['counts'] is None or len(phones) == target['counts']['phones'])
+    
+    print()
+    print("========================================")
+    if success:
+        print("  🎉 服务端备份恢复测试通过！")
+    else:
+        print("  ❌ 服务端备份恢复测试失败")
+    print("========================================")
+    
+    return success
+
 if __name__ == "__main__":
-    test_restore_simulation()
\ No newline at end of file
+    test_restore_simulation()
+    test_point_in_time_restore()
\ No newline at end of file